@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+from src.drivers import create_pixels
+from src.neopixel_controller import NeoPixelController
+from src.pythonCLI import StackCLI, SCRIPTS_PATH
+from src.stack_commands import commands, State
+
+
+class BenchmarkComplete(Exception):
+    pass
+
+
+class BenchmarkCLI(StackCLI):
+    def __init__(self, commands, state, runner):
+        super().__init__(commands, state)
+        self.runner = runner
+
+    async def sleep(self, time):
+        self.runner.advance(time)
+        if self.runner.done():
+            raise BenchmarkComplete("benchmark time elapsed")
+
+
+class ScriptRun:
+    def __init__(self, script, n, tps, seconds, trace_allocations=False, seed=0):
+        self.script = script
+        self.tps = tps
+        self.frames = int(seconds * tps)
+        self.trace_allocations = trace_allocations
+
+        self.messages = []
+        self.pixels = create_pixels(n, brightness=1, driver="simulated")
+        self.controller = NeoPixelController(self.pixels, tps=tps, threaded_output=False)
+        self.state = State(self.controller, self.pixels, send=self.messages.append)
+        self.state.rng = np.random.default_rng(seed)
+
+        self.render_times = []
+        self.particles = []
+        self.allocations = []
+
+    def done(self):
+        return len(self.render_times) >= self.frames
+
+    def advance(self, seconds):
+        frames = int(round(seconds * self.tps))
+        for _ in range(frames):
+            if self.done():
+                return
+            self.render_frame()
+
+    def render_frame(self):
+        time_delta = 1 / self.tps
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        self.controller.render(time_delta)
+        self.render_times.append(time.perf_counter() - start)
+
+        if self.trace_allocations:
+            self.allocations.append(tracemalloc.get_traced_memory()[1] - start_memory)
+        self.particles.append(count_particles(self.controller))
+
+    async def run(self):
+        cli = BenchmarkCLI(commands, self.state, self)
+        await cli.parse_input(f'read "{self.script}"')
+        while not self.done():
+            self.render_frame()
+
+
+def count_particles(controller):
+    return sum(stats["particles"] for _, stats in controller.physics_stats())
+
+
+def percentiles(values, scale=1):
+    if len(values) == 0:
+        return None
+    values = np.array(values) * scale
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max())
+    }
+
+
+def benchmark_script(script, n, tps, seconds, allocations=True, seed=0):
+    timing = ScriptRun(script, n, tps, seconds, seed=seed)
+    asyncio.run(timing.run())
+
+    budget = 1 / tps
+    engines = [stats for _, stats in timing.controller.physics_stats()]
+    result = {
+        "frames": len(timing.render_times),
+        "render ms": percentiles(timing.render_times, 1000),
+        "over budget": sum(1 for t in timing.render_times if t > budget),
+        "particles": percentiles(timing.particles),
+        "culled": sum(stats["culled"] for stats in engines),
+        "evicted": sum(stats["evicted"] for stats in engines),
+        "errors": [str(message) for message in timing.messages if isinstance(message, Exception)
+                   and not isinstance(message, BenchmarkComplete)]
+    }
+
+    if allocations:
+        tracemalloc.start()
+        traced = ScriptRun(script, n, tps, seconds, trace_allocations=True, seed=seed)
+        asyncio.run(traced.run())
+        result["allocated bytes"] = percentiles(traced.allocations)
+        result["retained bytes"] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+    return result
+
+
+def find_scripts(names):
+    if len(names) > 0:
+        return names
+    paths = glob.glob(os.path.join(SCRIPTS_PATH, "*.txt"))
+    return sorted(os.path.basename(path) for path in paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay light scripts on a simulated strip and report frame cost")
+    parser.add_argument("scripts", nargs="*", help="Script file names in the scripts path (default: all)")
+    parser.add_argument("-n", "--pixels", type=int, default=150, help="Strip length")
+    parser.add_argument("--tps", type=int, default=60, help="Frames per virtual second")
+    parser.add_argument("--seconds", type=float, default=10, help="Virtual seconds to run each script")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for random effects")
+    parser.add_argument("--no-allocations", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("-o", "--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = {
+        "pixels": args.pixels,
+        "tps": args.tps,
+        "seconds": args.seconds,
+        "seed": args.seed,
+        "scripts": {}
+    }
+    for script in find_scripts(args.scripts):
+        results["scripts"][script] = benchmark_script(
+            script, args.pixels, args.tps, args.seconds,
+            allocations=not args.no_allocations, seed=args.seed)
+        render = results["scripts"][script]["render ms"]
+        if render is not None:
+            print(f"{script:<24} p50 {render['p50']:7.3f} ms  p99 {render['p99']:7.3f} ms", file=sys.stderr)
+
+    output = json.dumps(results, indent=4)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as file:
+            file.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,7 @@ import asyncio
 from src.pythonCLI import StackCLI
 from src.effects.effects import *
 from src.neopixel_controller import *
-import asyncio
-import board
-import neopixel
+from src.render_process import create_controller
 from src.stack_commands import commands, State
 from decouple import config
 
@@ -32,16 +30,13 @@ async def startup():
     n = 150
 
     global cli
-    pixels = neopixel.NeoPixel(board.D10, n, brightness=0.5, auto_write=False)
-
-    pixel_control = NeoPixelController(pixels, tps=60)
+    pixel_control, pixels = create_controller(n, brightness=0.5, tps=60)
     state = State(pixel_control, pixels)
 
     cli = DiscordCLI(commands, state, client)
 
     asyncio.create_task(pixel_control.run())
 
-client.loop.create_task(startup())
 
 @client.event
 async def on_message(message):
@@ -56,4 +51,6 @@ async def on_ready():
     print(f'Logged in as {client.user}')
 
 # This will be reset
-client.run(CLIENT_KEY)
\ No newline at end of file
+if __name__ == "__main__":
+    client.loop.create_task(startup())
+    client.run(CLIENT_KEY)
\ No newline at end of file
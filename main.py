@@ -1,8 +1,7 @@
 from src.effects.effects import *
 from src.neopixel_controller import *
 import asyncio
-import board
-import neopixel
+from src.render_process import create_controller
 from src.pythonCLI import *
 from src.stack_commands import commands, State
 from src.colors import *
@@ -13,9 +12,7 @@ async def main():
     n = 150
     if (len(sys.argv) > 1):
         n = int(sys.argv[1])
-    pixels = neopixel.NeoPixel(board.D10, n, brightness=0.5, auto_write=False)
-
-    pixel_control = NeoPixelController(pixels, tps=60)
+    pixel_control, pixels = create_controller(n, brightness=0.5, tps=60)
     state = State(pixel_control, pixels)
     state.playback = PyAudioPlayer()
 
@@ -27,4 +24,5 @@ async def main():
 
     await asyncio.create_task(cli.run())
 
-asyncio.run(main())
+if __name__ == "__main__":
+    asyncio.run(main())
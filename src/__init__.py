@@ -1 +1 @@
-__all__ = ["color_utils", "colors", "config", "neopixel_controller", "pythonCLI", "stack_commands"]
+__all__ = ["color_utils", "colors", "config", "drivers", "frame_buffer", "frame_cache", "frame_output", "frame_scheduler", "layer_workers", "neopixel_controller", "pythonCLI", "render_process", "stack_commands"]
@@ -1,29 +1,59 @@
 import time
 import numpy as np
+from .frame_buffer import FrameBuffer, UNSET, to_rgba, colors_to_array, coverage_of, is_unset
+
 
 def clone_pixels(pixels):
+    if isinstance(pixels, FrameBuffer):
+        return pixels.copy()
     return list(tuple(pixels[i]) for i in range(len(pixels)))
 
 
 def clone_spliced_pixels(pixels, size, offset):
+    if isinstance(pixels, FrameBuffer):
+        indices = np.arange(offset, offset + size) % len(pixels)
+        return FrameBuffer(array=pixels.array[indices], covered=pixels.covered[indices])
     return list(tuple(pixels[i % len(pixels)]) for i in range(offset, offset+size))
 
 
 def resize_clone(pixels, size):
     N = len(pixels)
+    if isinstance(pixels, FrameBuffer):
+        if size < 2:
+            return pixels[:size]
+        indices = (np.arange(size) / (size - 1) * (N - 1)).astype(np.int64)
+        return FrameBuffer(array=pixels.array[indices], covered=pixels.covered[indices])
     return list(tuple(pixels[int(i/(size-1)*(N-1))]) for i in range(size))
 
 
 def set_pixels(pixels, colors):
+    if isinstance(pixels, FrameBuffer):
+        N = len(pixels)
+        pixels.array[:] = colors_to_array(colors)[:N]
+        pixels.covered[:] = coverage_of(colors)[:N]
+        return
     for i in range(len(pixels)):
         pixels[i] = colors[i]
 
 
 def fill_pixels(pixels, color):
+    if isinstance(pixels, FrameBuffer):
+        pixels.array[:] = to_rgba(color)
+        pixels.covered[:] = not is_unset(color)
+        return
     for i in range(len(pixels)):
         pixels[i] = color
 
 
+def gather_pixels(pixels, colors, indices):
+    if isinstance(pixels, FrameBuffer):
+        pixels.array[:] = colors_to_array(colors)[indices]
+        pixels.covered[:] = coverage_of(colors)[indices]
+        return
+    for i in range(len(pixels)):
+        pixels[i] = colors[int(indices[i])]
+
+
 def clamp(val, a=0, b=255):
     return min(max(val, a), b)
     
@@ -37,7 +67,19 @@ def scalar_mult(scalar, color, scale_alpha=True):
         clamp(scalar * alpha if scale_alpha else alpha, b=1))
 
 
+def scalar_mult_array(scalar, colors, scale_alpha=True):
+    result = np.empty(colors.shape, dtype=colors.dtype)
+    result[:, :3] = np.clip(np.trunc(scalar * colors[:, :3]), 0, 255)
+    alpha = scalar * colors[:, 3] if scale_alpha else colors[:, 3]
+    result[:, 3] = np.clip(alpha, 0, 1)
+    return result
+
+
 def scalar_mult_fill(scalar, pixels):
+    if isinstance(pixels, FrameBuffer):
+        pixels.array[:] = scalar_mult_array(scalar, pixels.array)
+        pixels.covered[:] = True
+        return
     for i in range(len(pixels)):
         pixels[i] = scalar_mult(scalar, pixels[i])
 
@@ -91,3 +133,34 @@ def multiply_colors(color1, color2):
         clamp(int(color1[2] * color2[2] / 255)),
         clamp(alpha1 * alpha2, 0, 1)
     )
+
+
+def overlay_arrays(colors1, colors2):
+    a1 = colors1[:, 3:]
+    a2 = colors2[:, 3:]
+    a3 = a1 * (1 - a2)
+    result = np.empty(colors1.shape)
+    result[:, :3] = np.clip(np.trunc(a2 * colors2[:, :3] + a3 * colors1[:, :3]), 0, 255)
+    result[:, 3:] = np.clip(a2 + a3, 0, 1)
+    return result
+
+
+def add_arrays(colors1, colors2):
+    result = np.empty(colors1.shape)
+    result[:, :3] = np.clip(np.trunc(colors1[:, :3] + colors2[:, :3]), 0, 255)
+    result[:, 3] = np.clip(colors1[:, 3] + colors2[:, 3], 0, 1)
+    return result
+
+
+def blend_arrays(colors1, colors2):
+    result = np.empty(colors1.shape)
+    result[:, :3] = np.clip(np.trunc((colors1[:, :3] + colors2[:, :3]) / 2), 0, 255)
+    result[:, 3] = np.clip((colors1[:, 3] + colors2[:, 3]) / 2, 0, 1)
+    return result
+
+
+def multiply_arrays(colors1, colors2):
+    result = np.empty(colors1.shape)
+    result[:, :3] = np.clip(np.trunc(colors1[:, :3] * colors2[:, :3] / 255), 0, 255)
+    result[:, 3] = np.clip(colors1[:, 3] * colors2[:, 3], 0, 1)
+    return result
@@ -0,0 +1,149 @@
+import time
+from collections import deque
+import numpy as np
+from .config import config
+
+
+def parse_byteorder(byteorder):
+    if byteorder.strip("RGBW") != "" or any(c not in byteorder for c in "RGB"):
+        raise Exception(f"{byteorder} is not a valid byte order")
+    return tuple(byteorder.index(c) for c in "RGBW" if c in byteorder)
+
+
+def encode_frame(frame, brightness=1.0, order=(0, 1, 2), out=None):
+    frame = np.clip(np.asarray(frame)[:, :3], 0, 255).astype(np.int64)
+    bpp = len(order)
+    channels = np.zeros((len(frame), bpp), dtype=np.int64)
+    channels[:, :3] = frame
+    if bpp == 4:
+        white = (frame[:, 0] == frame[:, 1]) & (frame[:, 1] == frame[:, 2])
+        channels[white, 3] = frame[white, 0]
+        channels[white, :3] = 0
+    if brightness != 1:
+        channels = (channels * float(brightness)).astype(np.int64)
+    if out is None:
+        out = np.empty((len(frame), bpp), dtype=np.uint8)
+    out[:, list(order)] = channels
+    return out
+
+
+def write_frame(pixels, frame):
+    if hasattr(pixels, "write_frame"):
+        pixels.write_frame(frame)
+    elif hasattr(pixels, "_post_brightness_buffer"):
+        write_pixelbuf(pixels, frame)
+    else:
+        for i in range(len(frame)):
+            pixels[i] = tuple(int(c) for c in frame[i][:3])
+
+
+def write_pixelbuf(pixels, frame):
+    start = pixels._offset
+    end = start + len(frame) * pixels._bpp
+    shape = (len(frame), pixels._bpp)
+    if pixels._pre_brightness_buffer is not None:
+        view = np.frombuffer(pixels._pre_brightness_buffer, dtype=np.uint8)[start:end]
+        encode_frame(frame, 1, pixels._byteorder, out=view.reshape(shape))
+    view = np.frombuffer(pixels._post_brightness_buffer, dtype=np.uint8)[start:end]
+    encode_frame(frame, pixels._brightness, pixels._byteorder, out=view.reshape(shape))
+
+
+class PixelDriver:
+    def __init__(self, n, brightness=1.0):
+        self.n = n
+        self.brightness = brightness
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        raise NotImplementedError(f"{self}.__getitem__() is not implemented yet")
+
+    def __setitem__(self, index, color):
+        raise NotImplementedError(f"{self}.__setitem__() is not implemented yet")
+
+    def show(self):
+        pass
+
+    def deinit(self):
+        pass
+
+
+class SimulatedPixels(PixelDriver):
+    def __init__(self, n, brightness=1.0, history=600, latency_per_pixel=0, byteorder="RGB"):
+        super().__init__(n, brightness)
+        self.pixels = np.zeros((n, 3), dtype=np.uint8)
+        self.latency_per_pixel = latency_per_pixel
+        self.byteorder = byteorder
+        self.order = parse_byteorder(byteorder)
+
+        self.frames = deque(maxlen=history)
+        self.show_times = deque(maxlen=history)
+        self.show_durations = deque(maxlen=history)
+        self.shows = 0
+        self.deinitialized = False
+
+    def __repr__(self):
+        return f"SimulatedPixels({self.n})"
+
+    def __getitem__(self, index):
+        return tuple(int(c) for c in self.pixels[index])
+
+    def __setitem__(self, index, color):
+        self.pixels[index] = tuple(int(c) for c in color[:3])
+
+    def write_frame(self, frame):
+        self.pixels[:] = np.clip(np.asarray(frame)[:, :3], 0, 255)
+
+    def show(self):
+        start = time.perf_counter()
+        self.frames.append(encode_frame(self.pixels, self.brightness, self.order).tobytes())
+        if self.latency_per_pixel > 0:
+            time.sleep(self.latency_per_pixel * self.n)
+        self.shows += 1
+        self.show_times.append(start)
+        self.show_durations.append(time.perf_counter() - start)
+
+    def deinit(self):
+        self.deinitialized = True
+
+    def last_frame(self):
+        if len(self.frames) == 0:
+            return None
+        return self.decode(self.frames[-1])
+
+    def decode(self, data):
+        channels = np.frombuffer(data, dtype=np.uint8).reshape(self.n, len(self.order))
+        return tuple(tuple(int(c) for c in color) for color in channels[:, list(self.order)])
+
+
+def create_neopixel(n, brightness=1.0):
+    import board
+    import neopixel
+    pin = getattr(board, config('pin', default="D10"))
+    return neopixel.NeoPixel(pin, n, brightness=brightness, auto_write=False,
+                             pixel_order=config('pixel order', default="GRB"))
+
+
+def create_simulated(n, brightness=1.0):
+    return SimulatedPixels(
+        n,
+        brightness=brightness,
+        history=config('simulated.history', default=600),
+        latency_per_pixel=config('simulated.latency per pixel', default=0),
+        byteorder=config('simulated.byteorder', default="RGB")
+    )
+
+
+DRIVERS = {
+    "neopixel": create_neopixel,
+    "simulated": create_simulated
+}
+
+
+def create_pixels(n, brightness=1.0, driver=None):
+    if driver is None:
+        driver = config('driver', default="neopixel")
+    if driver not in DRIVERS:
+        raise Exception(f"{driver} is not a valid driver, must be one of {list(DRIVERS)}")
+    return DRIVERS[driver](n, brightness)
@@ -1 +1 @@
-__all__ = ["control_effects", "effects", "music_effects", "physics_effects", "position_effects", "rand_effects"]
+__all__ = ["control_effects", "effects", "kernel_cache", "music_effects", "particle_store", "physics_effects", "position_effects", "rand_effects"]
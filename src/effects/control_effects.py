@@ -2,6 +2,9 @@ from ..color_utils import *
 from .effects import BaseEffect, DYNAMIC, STATIC
 
 class DebugClone(BaseEffect):
+    child_attributes = ("effect",)
+    fold_children = False
+
     def __init__(self, id, send, effect=None, depth=0):
         super().__init__(STATIC if effect is None else effect.type)
         self.id = id
@@ -22,6 +25,9 @@ class DebugClone(BaseEffect):
         
 
 class ShareEffect(BaseEffect):
+    child_attributes = ("box",)
+    fold_children = False
+
     def __init__(self, effect, reclones=0):
         super().__init__(effect.type)
         self.box = [effect] # a pointer to effect
@@ -41,6 +47,9 @@ class ShareEffect(BaseEffect):
     
     
 class Parent(BaseEffect):
+    child_attributes = ("effect",)
+    fold_children = False
+
     def __init__(self, effect):
         super().__init__(effect.type)
         self.effect = effect
@@ -56,6 +65,9 @@ class Parent(BaseEffect):
 
 
 class Child(BaseEffect):
+    child_attributes = ("effect",)
+    fold_children = False
+
     def __init__(self, parent):
         super().__init__(parent.effect.type)
         self.parent = parent
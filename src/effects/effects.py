@@ -1,6 +1,9 @@
 from copy import deepcopy
+from fractions import Fraction
 import math
 from ..color_utils import *
+from ..config import config
+from ..frame_cache import FRAME_CACHE
 
 
 STATIC = 'static'
@@ -41,7 +44,27 @@ def is_all_static(effects):
     return STATIC
 
 
+def combine_periods(periods):
+    result = Fraction(0)
+    for period in periods:
+        if period is None:
+            return None
+        period = Fraction(abs(period)).limit_denominator(1000)
+        if period == 0:
+            continue
+        if result == 0:
+            result = period
+        else:
+            numerator = math.lcm(result.numerator, period.numerator)
+            denominator = math.gcd(result.denominator, period.denominator)
+            result = Fraction(numerator, denominator)
+    return float(result)
+
+
 class BaseEffect:
+    child_attributes = ()
+    fold_children = True
+
     def __init__(self, type=DYNAMIC):
         self.type = type
 
@@ -51,6 +74,171 @@ class BaseEffect:
     def clone(self):
         raise NotImplementedError(f"{self}.clone() is not implemented yet")
 
+    def children(self):
+        children = []
+        for name in self.child_attributes:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                children.extend(value)
+            elif isinstance(value, BaseEffect):
+                children.append(value)
+        return children
+
+    def reads_input(self):
+        children = self.children()
+        if len(children) == 0:
+            return True
+        return any(child.reads_input() for child in children)
+
+    def get_period(self):
+        if self.type != STATIC:
+            return None
+        return combine_periods([child.get_period() for child in self.children()])
+
+
+class FoldedEffect(BaseEffect):
+    def __init__(self, effect):
+        super().__init__(type=STATIC)
+        self.effect = effect
+        self.input_dependent = effect.reads_input()
+        self.colors = None
+        self.input = None
+        self.folds = 0
+
+    def tick(self, pixels, time_delta):
+        if self._is_stale(pixels):
+            if self.input_dependent:
+                self.input = clone_pixels(pixels)
+            self.colors = clone_pixels(pixels)
+            self.effect.tick(self.colors, time_delta)
+            self.folds += 1
+        set_pixels(pixels, self.colors)
+
+    def _is_stale(self, pixels):
+        if self.colors is None or len(self.colors) != len(pixels):
+            return True
+        if not self.input_dependent:
+            return False
+        return not (np.array_equal(self.input.array, pixels.array)
+                    and np.array_equal(self.input.covered, pixels.covered))
+
+    def reads_input(self):
+        return self.input_dependent
+
+    def get_period(self):
+        return self.effect.get_period()
+
+    def clone(self):
+        return FoldedEffect(self.effect.clone())
+
+
+class PeriodicCache(BaseEffect):
+    child_attributes = ("effect",)
+    fold_children = False
+
+    def __init__(self, effect, period, tps, lookahead=None):
+        super().__init__(type=DYNAMIC)
+        self.effect = effect
+        self.period = period
+        self.tps = tps
+        self.nframes = max(1, round(period * tps))
+        self.lookahead = lookahead if lookahead is not None else config('frame cache.lookahead', default=1)
+        self.time_sum = 0
+        self.effect_frame = None
+        self.ring = None
+        self.buffer = None
+        self.uncacheable = False
+
+    def tick(self, pixels, time_delta):
+        self.time_sum += time_delta
+        if self.uncacheable:
+            self.effect.tick(pixels, time_delta)
+            return
+
+        if self.ring is None or self.ring.evicted or self.ring.size != len(pixels):
+            self._reset(pixels)
+            if self.ring is None:
+                self.uncacheable = True
+                if self.effect_frame is None:
+                    self.effect.tick(pixels, self.time_sum)
+                else:
+                    step = self.period / self.nframes
+                    self.effect.tick(pixels, (self.time_sum - self.effect_frame * step) % self.period)
+                return
+
+        phase = (self.time_sum % self.period) / self.period
+        index = round(phase * self.nframes) % self.nframes
+        if index < self.ring.filled:
+            FRAME_CACHE.hits += 1
+        else:
+            FRAME_CACHE.misses += 1
+        self._render_until(min(self.nframes, max(index + 1, self.ring.filled + self.lookahead)))
+        self.ring.load(index, pixels)
+        FRAME_CACHE.touch(self.ring)
+
+    def _reset(self, pixels):
+        if self.ring is not None:
+            FRAME_CACHE.release(self.ring)
+        self.ring = FRAME_CACHE.allocate(self.nframes, len(pixels))
+        self.buffer = clone_pixels(pixels)
+
+    def _render_until(self, filled):
+        step = self.period / self.nframes
+        while self.ring.filled < filled:
+            if self.effect_frame is None:
+                self.effect.tick(self.buffer, 0)
+            else:
+                self.effect.tick(self.buffer, (self.ring.filled - self.effect_frame) % self.nframes * step)
+            self.effect_frame = self.ring.filled
+            self.ring.store(self.ring.filled, self.buffer)
+            self.ring.filled += 1
+
+    def reads_input(self):
+        return False
+
+    def get_period(self):
+        return self.period
+
+    def clone(self):
+        return PeriodicCache(self.effect.clone(), self.period, self.tps, self.lookahead)
+
+
+def cache_periodic(effect, tps):
+    if isinstance(effect, PeriodicCache) or effect.type == STATIC:
+        return effect
+    period = effect.get_period()
+    if period is not None and period > 0 and not effect.reads_input():
+        return PeriodicCache(effect, period, tps)
+    if not effect.fold_children:
+        return effect
+    for name in effect.child_attributes:
+        value = getattr(effect, name)
+        if isinstance(value, list):
+            for i in range(len(value)):
+                if isinstance(value[i], BaseEffect):
+                    value[i] = cache_periodic(value[i], tps)
+        elif isinstance(value, BaseEffect):
+            setattr(effect, name, cache_periodic(value, tps))
+    return effect
+
+
+def fold_static(effect):
+    if isinstance(effect, FoldedEffect):
+        return effect
+    if effect.type == STATIC:
+        return FoldedEffect(effect)
+    if not effect.fold_children:
+        return effect
+    for name in effect.child_attributes:
+        value = getattr(effect, name)
+        if isinstance(value, list):
+            for i in range(len(value)):
+                if isinstance(value[i], BaseEffect):
+                    value[i] = fold_static(value[i])
+        elif isinstance(value, BaseEffect):
+            setattr(effect, name, fold_static(value))
+    return effect
+
 
 class ColorAdapter(BaseEffect):
     def __init__(self, color_selector):
@@ -62,11 +250,16 @@ class ColorAdapter(BaseEffect):
         for i in range(n):
             pixels[i] = self.color.get_color(i/n)
 
+    def reads_input(self):
+        return False
+
     def clone(self):
         return ColorAdapter(self.color)
     
 
 class AlphaAdapter(BaseEffect):
+    child_attributes = ("effect",)
+
     def __init__(self, effect, alpha):
         super().__init__(effect.type)
         self.effect = effect
@@ -74,21 +267,23 @@ class AlphaAdapter(BaseEffect):
         
     def tick(self, pixels, time_delta):
         self.effect.tick(pixels, time_delta)
-        for i in range(len(pixels)):
-            color = pixels[i]
-            a = 1 if len(color) < 4 else color[3]
-            pixels[i] = (
-                int(color[0] / a * self.alpha), 
-                int(color[1] / a * self.alpha), 
-                int(color[2] / a * self.alpha), 
-                self.alpha
-            )
+        colors = pixels.array
+        a = colors[:, 3:]
+        scale = np.divide(self.alpha, a, out=np.zeros_like(a), where=a != 0)
+        colors[:, :3] = np.trunc(colors[:, :3] * scale)
+        colors[:, 3] = self.alpha
+        pixels.covered[:] = True
+
+    def get_period(self):
+        return self.effect.get_period()
             
     def clone(self):
         return AlphaAdapter(self.effect.clone(), self.alpha)
 
 
 class DynamicSplit(BaseEffect):
+    child_attributes = ("effects",)
+
     def __init__(self, color_effects):
         super().__init__(is_all_static(color_effects))
         if isinstance(color_effects, list):
@@ -97,7 +292,6 @@ class DynamicSplit(BaseEffect):
             self.effects = [color_effects]
         self.n = len(self.effects)
         self.portion = 1/self.n
-        self.cached = {}
 
     def tick(self, pixels, time_delta):
         N = len(pixels)
@@ -106,16 +300,14 @@ class DynamicSplit(BaseEffect):
         right = 0
         for i in range(self.n):
             right += self.portion * N
-            if self.effects[i].type != STATIC or i not in self.cached:
-                color = clone_spliced_pixels(pixels, int(right - left), left)
-                self.effects[i].tick(color, time_delta)
-                if self.effects[i].type == STATIC: 
-                    self.cached[i] = color
-            else:
-                color = self.cached[i]
+            color = clone_spliced_pixels(pixels, int(right - left), left)
+            self.effects[i].tick(color, time_delta)
             pixels[left:int(right)] = color
             left = int(right)
 
+    def get_period(self):
+        return combine_periods([effect.get_period() for effect in self.effects])
+
     def clone(self):
         effects = []
         for effect in self.effects:
@@ -124,6 +316,8 @@ class DynamicSplit(BaseEffect):
 
 
 class DynamicGradient(BaseEffect):
+    child_attributes = ("effects",)
+
     def __init__(self, color_effects, sampling_weights=-1):
         super().__init__(is_all_static(color_effects))
         if isinstance(color_effects, list):
@@ -137,8 +331,6 @@ class DynamicGradient(BaseEffect):
             self.weights = sampling_weights
         else:
             self.weights = [sampling_weights]
-            
-        self.cached = {}
 
     def tick(self, pixels, time_delta):
         N = len(pixels)
@@ -146,38 +338,34 @@ class DynamicGradient(BaseEffect):
         colors, differences = self._get_gradient_rays(pixels, time_delta)
 
         n = len(colors)
-
-        for i in range(N):
-            value = i / (N-1)
-            if n == 1:
-                pixels[i] = colors[0]
-            elif value == 0:
-                pixels[i] = colors[0]
-            else:
-                value *= (n - 1)
-                j = math.ceil(value) - 1
-                pixels[i] = self._get_gradient(colors[j], differences[j], (value - j))
+        if n == 1 or N == 1:
+            fill_pixels(pixels, colors[0])
+            return
+
+        colors = colors_to_array(colors)
+        differences = np.array(differences, dtype=np.float64)
+        value = np.arange(N) / (N - 1) * (n - 1)
+        j = np.maximum(np.ceil(value).astype(np.int64) - 1, 0)
+        t = (value - j)[:, None]
+        gradient = colors[j] + t * differences[j]
+        gradient[:, :3] = np.trunc(gradient[:, :3])
+        gradient[0] = colors[0]
+        pixels.array[:] = gradient
+        pixels.covered[:] = True
                 
     def _get_gradient_rays(self, pixels, time_delta):
         N = len(pixels)
         colors = []
         differences = []
         for i in range(len(self.effects)):
-            is_dynamic = self.effects[i].type != STATIC
-            do_tick = is_dynamic or i not in self.cached
-            if do_tick:
-                color = clone_pixels(pixels)
-                self.effects[i].tick(color, time_delta)
-                if not is_dynamic:
-                    self.cached[i] = []
+            color = clone_pixels(pixels)
+            self.effects[i].tick(color, time_delta)
             weight = self.weights[i]
             for j in range(weight):
-                pixel = color[int(j/weight * N)] if do_tick else self.cached[i][j]
+                pixel = color[int(j/weight * N)]
                 if len(colors) > 0:
                     differences.append(self._difference(pixel, colors[-1]))
                 colors.append(pixel)
-                if not is_dynamic and do_tick:
-                    self.cached[i].append(pixel)
         return colors, differences
     
     def _difference(self, color1, color2):
@@ -189,15 +377,9 @@ class DynamicGradient(BaseEffect):
             int(color1[2] - color2[2]),
             alpha1 - alpha2
         )
-        
-    def _get_gradient(self, color, diff, value):
-        alpha = 1 if len(color) < 4 else color[3]
-        return (
-            int(color[0] + value * diff[0]),
-            int(color[1] + value * diff[1]),
-            int(color[2] + value * diff[2]),
-            alpha + value * diff[3]
-        )
+
+    def get_period(self):
+        return combine_periods([effect.get_period() for effect in self.effects])
 
     def clone(self):
         effects = []
@@ -207,6 +389,8 @@ class DynamicGradient(BaseEffect):
 
 
 class BlinkEffect(BaseEffect):
+    child_attributes = ("color",)
+
     def __init__(self, color, time_length):
         super().__init__()
         self.color = color
@@ -237,6 +421,8 @@ class BlinkEffect(BaseEffect):
 
 
 class ColorWipe(BaseEffect):
+    child_attributes = ("color",)
+
     def __init__(self, color, time_length):
         super().__init__(type=DYNAMIC)
         self.color = color
@@ -255,24 +441,24 @@ class ColorWipe(BaseEffect):
 
         cutoff = self.time_sum / self.time_length * n
         self.time_sum += time_delta
+        index = np.arange(n)
         if (self.time_length > 0):
-            for i in range(n):
-                if cutoff >= i:
-                    pixels[i] = self.colors[i]
-                else:
-                    pixels[i] = self.original[i]
+            wiped = cutoff >= index
         else:
-            for i in range(-1, -(n + 1), -1):
-                if cutoff - 1 <= i:
-                    pixels[i] = self.colors[i]
-                else:
-                    pixels[i] = self.original[i]
+            wiped = cutoff - 1 <= index - n
+        pixels.array[:] = np.where(wiped[:, None], self.colors.array, self.original.array)
+        pixels.covered[:] = np.where(wiped, self.colors.covered, self.original.covered)
+
+    def reads_input(self):
+        return True
 
     def clone(self):
         return ColorWipe(self.color.clone(), self.time_length)
 
 
 class FadeIn(BaseEffect):
+    child_attributes = ("color",)
+
     def __init__(self, color, time_length):
         super().__init__(type=DYNAMIC)
         self.color = color
@@ -294,6 +480,8 @@ class FadeIn(BaseEffect):
 
 
 class FadeOut(BaseEffect):
+    child_attributes = ("color",)
+
     def __init__(self, color, time_length):
         super().__init__(type=DYNAMIC)
         self.color = color
@@ -315,6 +503,8 @@ class FadeOut(BaseEffect):
 
 
 class BlinkFade(BaseEffect):
+    child_attributes = ("color",)
+
     def __init__(self, color, time_length):
         super().__init__(type=DYNAMIC)
         self.color = color
@@ -328,15 +518,20 @@ class BlinkFade(BaseEffect):
             self.color.tick(self.colors, time_delta)
 
         self.time_sum += time_delta
-        scalar_mult_fill(
-            (math.sin(self.time_sum/self.time_length * math.pi) + 1) / 2, self.colors)
         set_pixels(pixels, self.colors)
+        scalar_mult_fill(
+            (math.sin(self.time_sum/self.time_length * math.pi) + 1) / 2, pixels)
+
+    def get_period(self):
+        return combine_periods([2 * self.time_length, self.color.get_period()])
 
     def clone(self):
         return BlinkFade(self.color.clone(), self.time_length)
 
 
 class WaveEffect(BaseEffect):
+    child_attributes = ("color",)
+
     def __init__(self, color, period, wavelength):
         super().__init__(type=DYNAMIC)
         self.color = color
@@ -353,17 +548,21 @@ class WaveEffect(BaseEffect):
 
         self.time_sum += time_delta
         n = len(self.colors)
-        for i in range(n):
-            phase = (i/self.wavelength - self.time_sum /
-                     self.period) * 2 * math.pi
-            value = (1 + math.sin(phase)) / 2
-            pixels[i] = self.colors[int(value * (n - 1))]
+        phase = (np.arange(n) / self.wavelength - self.time_sum /
+                 self.period) * 2 * math.pi
+        value = (1 + np.sin(phase)) / 2
+        gather_pixels(pixels, self.colors, (value * (n - 1)).astype(np.int64))
+
+    def get_period(self):
+        return combine_periods([self.period, self.color.get_period()])
 
     def clone(self):
         return WaveEffect(self.color.clone(), self.period, self.wavelength)
 
 
 class WheelEffect(BaseEffect):
+    child_attributes = ("color",)
+
     def __init__(self, color, period):
         super().__init__(type=DYNAMIC)
         self.color = color
@@ -382,14 +581,18 @@ class WheelEffect(BaseEffect):
         value = (1 + math.sin(phase)) / 2
 
         n = len(self.colors)
-        for i in range(n):
-            pixels[i] = self.colors[int(value * (n - 1))]
+        fill_pixels(pixels, self.colors[int(value * (n - 1))])
+
+    def get_period(self):
+        return combine_periods([self.period, self.color.get_period()])
 
     def clone(self):
         return WheelEffect(self.color.clone(), self.period)
 
 
 class WipeEffect(BaseEffect):
+    child_attributes = ("color",)
+
     def __init__(self, color, period):
         super().__init__(type=DYNAMIC)
         self.color = color
@@ -406,14 +609,18 @@ class WipeEffect(BaseEffect):
 
         self.time_sum += time_delta
         offset = int((self.time_sum / self.period) * n)
-        for i in range(n):
-            pixels[i] = self.colors[offset % n]
+        fill_pixels(pixels, self.colors[offset % n])
+
+    def get_period(self):
+        return combine_periods([self.period, self.color.get_period()])
 
     def clone(self):
         return WipeEffect(self.color.clone(), self.period)
 
 
 class SlidingEffect(BaseEffect):
+    child_attributes = ("color",)
+
     def __init__(self, color, period):
         super().__init__(type=DYNAMIC)
         self.color = color
@@ -430,8 +637,10 @@ class SlidingEffect(BaseEffect):
 
         self.time_sum += time_delta
         offset = int((self.time_sum / self.period) * n)
-        for i in range(n):
-            pixels[i] = self.colors[(i - offset) % n]
+        gather_pixels(pixels, self.colors, (np.arange(n) - offset) % n)
+
+    def get_period(self):
+        return combine_periods([self.period, self.color.get_period()])
 
     def clone(self):
         return SlidingEffect(self.color.clone(), self.period)
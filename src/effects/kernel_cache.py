@@ -0,0 +1,126 @@
+from collections import OrderedDict
+import numpy as np
+from ..config import config
+
+
+def build_kernel(radius, size, buckets, bounds):
+    steps = np.arange(-bounds, bounds + 2)
+    offsets = np.arange(buckets) / buckets
+    dx = offsets[:, None] - steps[None, :]
+    value = np.exp(-(dx * dx) / (2 * radius * radius)) * size
+    visible = (np.abs(dx) < 3 * radius) & (value >= 1)
+    return np.where(visible, size - value.astype(np.int64), -1)
+
+
+def evaluate_kernels(radii, sizes, positions):
+    bounds = int(3 * radii.max() + 1)
+    steps = np.arange(-bounds, bounds + 2)
+    dx = (positions - np.floor(positions))[:, None] - steps[None, :]
+    radii = radii[:, None]
+    sizes = sizes[:, None]
+    value = np.exp(-(dx * dx) / (2 * radii * radii)) * sizes
+    visible = (np.abs(dx) < 3 * radii) & (value >= 1)
+    return np.where(visible, sizes - value.astype(np.int64), -1), steps
+
+
+class KernelCache:
+    def __init__(self, max_kernels, buckets, max_radius):
+        self.max_kernels = max_kernels
+        self.buckets = buckets
+        self.max_bounds = int(3 * max_radius + 1)
+        self.slots = OrderedDict()
+        self.capacity = 0
+        self.free = []
+        self.bounds = 0
+        self.table = np.full((0, 2), -1, dtype=np.int32)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.overflows = 0
+
+    def fits(self, radius):
+        return int(3 * radius + 1) <= self.max_bounds
+
+    def steps(self):
+        return np.arange(-self.bounds, self.bounds + 2)
+
+    def rows(self, slots, positions):
+        fraction = positions - np.floor(positions)
+        buckets = np.minimum((fraction * self.buckets).astype(np.int64), self.buckets - 1)
+        return self.table[slots * self.buckets + buckets]
+
+    def lookup_all(self, radii, sizes):
+        keys = list(zip(radii, sizes))
+        unique = dict.fromkeys(keys, -1)
+        cached = 0
+        for key in unique:
+            if cached < self.max_kernels and self.fits(key[0]):
+                unique[key] = self.lookup(*key)
+                cached += 1
+            else:
+                self.overflows += 1
+        return np.array([unique[key] for key in keys], dtype=np.int64)
+
+    def lookup(self, radius, size):
+        key = (radius, size)
+        slot = self.slots.get(key)
+        if slot is not None:
+            self.hits += 1
+            self.slots.move_to_end(key)
+            return slot
+
+        self.misses += 1
+        if len(self.free) == 0:
+            if self.capacity < self.max_kernels:
+                self._grow(min(self.max_kernels, max(8, 2 * self.capacity)))
+            else:
+                _, evicted = self.slots.popitem(last=False)
+                self.free.append(evicted)
+                self.evictions += 1
+        slot = self.free.pop()
+
+        bounds = int(3 * radius + 1)
+        if bounds > self.bounds:
+            self._widen(bounds)
+        start = slot * self.buckets
+        self.table[start:start + self.buckets] = build_kernel(radius, size, self.buckets, self.bounds)
+        self.slots[key] = slot
+        return slot
+
+    def _grow(self, capacity):
+        table = np.full((capacity * self.buckets, self.table.shape[1]), -1, dtype=np.int32)
+        table[:len(self.table)] = self.table
+        self.table = table
+        self.free = list(range(capacity - 1, self.capacity - 1, -1)) + self.free
+        self.capacity = capacity
+
+    def _widen(self, bounds):
+        table = np.full((len(self.table), 2 * bounds + 2), -1, dtype=np.int32)
+        shift = bounds - self.bounds
+        table[:, shift:shift + self.table.shape[1]] = self.table
+        self.table = table
+        self.bounds = bounds
+
+    def clear(self):
+        self.slots.clear()
+        self.free = list(range(self.capacity - 1, -1, -1))
+
+    def stats(self):
+        return {
+            "kernels": len(self.slots),
+            "max kernels": self.max_kernels,
+            "buckets": self.buckets,
+            "max bounds": self.max_bounds,
+            "bytes": self.table.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "overflows": self.overflows
+        }
+
+
+KERNEL_CACHE = KernelCache(
+    config('kernel cache.max kernels', default=64),
+    config('kernel cache.buckets', default=128),
+    config('kernel cache.max radius', default=8)
+)
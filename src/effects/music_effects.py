@@ -1,3 +1,4 @@
+from functools import lru_cache
 from .effects import BaseEffect, DYNAMIC, STATIC
 import pyaudio
 import numpy as np
@@ -6,7 +7,8 @@ from scipy.fftpack import next_fast_len
 from ..color_utils import *
 
 
-def bin_frequencies(ints, freqs, nbins, min_freq, max_freq, linear=True):
+@lru_cache(maxsize=32)
+def frequency_bins(rate, length, nbins, min_freq, max_freq, linear=True):
     if linear:
         portion = (max_freq - min_freq) / nbins
         next_max = min_freq + portion
@@ -14,41 +16,28 @@ def bin_frequencies(ints, freqs, nbins, min_freq, max_freq, linear=True):
         portion = (max_freq / min_freq) ** (1 / nbins)
         next_max = min_freq * portion
 
-    # print(next_max)
-
-    # print(ints, freqs)
-
-    N = len(ints)
-    bins = [0 for i in range(nbins)]
-    bin_index = 0
-
-    bin = 0
-    bin_size = 0
-    for i in range(N):
-        if freqs[i] < min_freq:
-            continue
-        while freqs[i] >= next_max:
-            # if bin_size > 0:
-            # bin /= bin_size
-
-            bins[bin_index] = bin
-            bin_index += 1
-            bin = 0
-            bin_size = 0
+    # Bins whose upper edge passes max_freq or the last FFT frequency stay empty
+    freqs = rfftfreq(length, 1/rate)
+    edges = []
+    for i in range(nbins):
+        if (i > 0 and next_max > max_freq) or next_max > freqs[-1]:
+            break
+        edges.append(next_max)
+        if linear:
+            next_max += portion
+        else:
+            next_max *= portion
 
-            if linear:
-                next_max += portion
-            else:
-                next_max *= portion
-            # print(next_max)
-            if next_max > max_freq:
-                return np.array(bins)
+    edges = np.array(edges)
+    index = np.searchsorted(edges, freqs, side="right")
+    index[(freqs < min_freq) | (index >= len(edges))] = nbins
+    index.flags.writeable = False
+    return index
 
-        if freqs[i] < next_max:
-            bin += ints[i]
-            bin_size += 1
 
-    return np.array(bins)
+def bin_frequencies(ints, rate, length, nbins, min_freq, max_freq, linear=True):
+    index = frequency_bins(rate, length, nbins, min_freq, max_freq, linear)
+    return np.bincount(index, weights=ints, minlength=nbins + 1)[:nbins]
 
 
 def fft(values, length, rate, nbins, min_freq, max_freq, linear, time_delta, threshold, fade):
@@ -57,9 +46,7 @@ def fft(values, length, rate, nbins, min_freq, max_freq, linear, time_delta, thr
     ints = rfft(values, length)
     ints = abs(ints)
 
-    freq = rfftfreq(length, 1/rate)
-
-    bins = bin_frequencies(ints, freq, nbins, min_freq,
+    bins = bin_frequencies(ints, rate, length, nbins, min_freq,
                            max_freq, linear=linear)
     bin_max = bins.max()
 
@@ -253,6 +240,8 @@ class PlayMusicStream(BaseEffect):
 
 
 class SpectrumEffect(BaseEffect):
+    child_attributes = ("color",)
+
     def __init__(self, color, wavfile, playback=None, linear=True, nbins=37, min_freq=115, max_freq=900):
         super().__init__(type=DYNAMIC)
         self.wavfile = wavfile
@@ -318,6 +307,8 @@ class SpectrumEffect(BaseEffect):
 
 
 class SpectrumEffectStream(BaseEffect):
+    child_attributes = ("color",)
+
     def __init__(self,
                  color,
                  stream,
@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class ParticleStore:
+    FIELDS = ("position", "velocity", "acceleration", "mass", "prev_pos", "prev_vel", "brightness", "radius")
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        for name in self.FIELDS:
+            setattr(self, name, np.zeros(capacity))
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return self.capacity - len(self.free)
+
+    def allocate(self):
+        if len(self.free) == 0:
+            self._grow()
+        slot = self.free.pop()
+        self.alive[slot] = True
+        return slot
+
+    def allocate_batch(self, count):
+        while len(self.free) < count:
+            self._grow()
+        slots = np.array(self.free[len(self.free) - count:][::-1], dtype=np.int64)
+        del self.free[len(self.free) - count:]
+        self.alive[slots] = True
+        return slots
+
+    def release(self, slot):
+        self.alive[slot] = False
+        self.velocity[slot] = 0
+        self.acceleration[slot] = 0
+        self.free.append(slot)
+
+    def _grow(self):
+        capacity = self.capacity * 2
+        for name in self.FIELDS + ("alive",):
+            old = getattr(self, name)
+            array = np.zeros(capacity, dtype=old.dtype)
+            array[:self.capacity] = old
+            setattr(self, name, array)
+        self.free = list(range(capacity - 1, self.capacity - 1, -1)) + self.free
+        self.capacity = capacity
+
+    def integrate(self, time_delta):
+        self.prev_pos[:] = self.position
+        self.prev_vel[:] = self.velocity
+        self.position += (self.velocity + self.acceleration * time_delta / 2) * time_delta
+        self.velocity += self.acceleration * time_delta
+
+
+class StoredField:
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.local = "_" + name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        store = obj.store
+        if store is None:
+            return obj.__dict__[self.local]
+        return getattr(store, self.name)[obj.slot].item()
+
+    def __set__(self, obj, value):
+        store = obj.store
+        if store is None:
+            obj.__dict__[self.local] = value
+        else:
+            getattr(store, self.name)[obj.slot] = value
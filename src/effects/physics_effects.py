@@ -1,53 +1,518 @@
+import heapq
 import math
 from ..color_utils import *
+from ..config import config
 from .effects import DYNAMIC, STATIC, BaseEffect
+from .particle_store import ParticleStore, StoredField
+from .kernel_cache import KERNEL_CACHE, evaluate_kernels
+
+OLDEST = "oldest"
+DIMMEST = "dimmest"
+EVICTION_POLICIES = [OLDEST, DIMMEST]
+USE_CONFIG = object()
+REACH_SLACK = 1e-9
+
 
 class PhysicsEngine(BaseEffect):
-    def __init__(self, physics_effects):
+    def __init__(self, physics_effects, max_particles=None, eviction=None, cull_margin=USE_CONFIG,
+                 step_rate=None, max_substeps=None, rng=None):
         super().__init__()
-        self.effects = set(physics_effects)
+        if max_particles is None:
+            max_particles = config('physics.max particles', default=2000)
+        if eviction is None:
+            eviction = config('physics.eviction', default=OLDEST)
+        if eviction not in EVICTION_POLICIES:
+            raise Exception(f"{eviction} is not a valid eviction policy, must be one of {EVICTION_POLICIES}")
+        if cull_margin is USE_CONFIG:
+            cull_margin = None
+            if config('physics.cull', default=True):
+                cull_margin = config('physics.cull margin', default=0)
+        if cull_margin is False:
+            cull_margin = None
+        self.max_particles = max_particles
+        self.eviction = eviction
+        self.cull_margin = cull_margin
+        if step_rate is None:
+            step_rate = config('physics.step rate', default=0)
+        if max_substeps is None:
+            max_substeps = config('physics.max substeps', default=8)
+        if step_rate < 0:
+            raise Exception(f"{step_rate} is not a valid step rate, must be 0 or positive")
+        if max_substeps < 1:
+            raise Exception(f"{max_substeps} is not a valid substep limit, must be at least 1")
+        self.step_rate = step_rate
+        self.max_substeps = max_substeps
+        self.accumulator = 0
+        self.alpha = None
+        self.substeps = 0
+        self.dropped_steps = 0
+        self.culled = 0
+        self.evicted = 0
+        self.attached = 0
+
+        self.store = ParticleStore()
+        self.fields = FieldRegistry()
+        self.effects = {}
+        for effect in physics_effects:
+            self._attach(effect)
         self.new_effects = []
-        self.components = {}
+        self.spawned = []
+        if rng is None:
+            rng = np.random.default_rng()
+        self.seeds = rng
+        self.rng = np.random.default_rng(rng.integers(2 ** 63))
+        self.solver = CollisionSolver()
     
     def tick(self, pixels, time_delta):      
         N = len(pixels)
         colors = clone_pixels(pixels)
-        self.tick_effects(colors, time_delta)
+        if self.step_rate > 0:
+            self.step(colors, time_delta)
+        else:
+            self.tick_effects(colors, time_delta)
 
-        for i in range(N):
-            pixels[i] = (0, 0, 0, 0)
+        particles = []
+        others = []
         for effect in self.effects:
-            left = math.floor(effect.body.position - effect.bounds)
-            right = math.ceil(effect.body.position + effect.bounds)
-            for x in range(left, right + 1):
-                if 0 <= x < N:
-                    pixels[x] = add_colors(effect.get_pixel(x), pixels[x])
+            if isinstance(effect, ParticleEffect):
+                if effect.N > 0:
+                    particles.append(effect)
+            else:
+                others.append(effect)
+
+        result = FrameBuffer(array=splat_particles(particles, N, self.alpha), covered=np.ones(N, dtype=bool))
+        for effect in others:
+            for x, color in effect.get_pixels(N):
+                result[x] = add_colors(color, result[x])
+        set_pixels(pixels, result)
           
     
+    def step(self, colors, time_delta):
+        step = 1 / self.step_rate
+        self.accumulator += time_delta
+        steps = int(self.accumulator * self.step_rate + 1e-6)
+        if steps > self.max_substeps:
+            self.dropped_steps += steps - self.max_substeps
+            self.accumulator -= (steps - self.max_substeps) * step
+            steps = self.max_substeps
+        for _ in range(steps):
+            self.tick_effects(colors, step)
+            self.accumulator -= step
+        self.substeps += steps
+        self.alpha = min(max(self.accumulator * self.step_rate, 0), 1)
+
     def tick_effects(self, colors, time_delta):
+        self.store.integrate(time_delta)
+        if self.cull_margin is not None:
+            self.cull(len(colors))
+        self.detect_collisions(time_delta)
+        self.fields.apply(self.store, time_delta)
         dead_effects = []
         for effect in self.effects:
             effect.tick(self, colors, time_delta)
             if not effect.is_alive:
                 dead_effects.append(effect)
         for effect in dead_effects:
-            self.effects.remove(effect)
+            self._remove(effect)
         for effect in self.new_effects:
-            self.effects.add(effect)
+            self._attach(effect)
         self.new_effects = []
+        for effect in self.spawned:
+            effect.spawn_order = self.attached
+            self.attached += 1
+            self.fields.track(effect)
+        self.effects.update(dict.fromkeys(self.spawned))
+        self.spawned = []
+        if 0 < self.max_particles < len(self.effects):
+            self.evict(len(self.effects) - self.max_particles)
+
+    def cull(self, N):
+        effects = list(self.effects)
+        if len(effects) == 0:
+            return
+        slots = np.array([effect.slot for effect in effects], dtype=np.int64)
+        reach = np.array([effect.bounds for effect in effects], dtype=np.float64) + self.cull_margin
+        position = self.store.position[slots]
+        velocity = self.store.velocity[slots]
+        acceleration = self.store.acceleration[slots]
+        receding = (((position + reach < 0) & (velocity < 0) & (acceleration <= 0))
+                    | ((position - reach > N - 1) & (velocity > 0) & (acceleration >= 0)))
+        for i in np.flatnonzero(receding).tolist():
+            effect = effects[i]
+            if effect.is_cullable():
+                self._remove(effect)
+                self.culled += 1
+
+    def evict(self, count):
+        candidates = [effect for effect in self.effects if effect.is_cullable()]
+        count = min(count, len(candidates))
+        if count <= 0:
+            return
+        if self.eviction == OLDEST:
+            keys = np.array([effect.spawn_order for effect in candidates])
+        else:
+            keys = self.store.brightness[[effect.slot for effect in candidates]]
+        for i in np.argpartition(keys, count - 1)[:count].tolist():
+            self._remove(candidates[i])
+        self.evicted += count
+
+    def _remove(self, effect):
+        effect.is_alive = False
+        del self.effects[effect]
+        self.fields.forget(effect)
+        effect.detach()
             
     
     def add_effect(self, effect):
         self.new_effects.append(effect)
+
+    def spawn_batch(self, prototype, count, position=0, velocity=0):
+        if not prototype.compiled:
+            for _ in range(count):
+                effect = prototype.spawn()
+                effect.body.position += position
+                effect.body.velocity += velocity
+                self.add_effect(effect)
+            return
+        slots = self.store.allocate_batch(count)
+        self.spawned.extend(prototype.spawn_batch(self.store, slots, self.rng))
+        self.store.position[slots] += position
+        self.store.prev_pos[slots] += position
+        self.store.velocity[slots] += velocity
+        self.store.prev_vel[slots] += velocity
+
+    def detect_collisions(self, time_delta):
+        collidables = [effect for effect in self.effects if effect.collidable and effect.is_alive]
+        for effect in collidables:
+            effect.has_collision = False
+            effect.collisions = {}
+
+        pairs = list(sweep_pairs(self.store, [effect.slot for effect in collidables]))
+        for i, j in pairs:
+            effect = collidables[i]
+            other = collidables[j]
+            collision_time = effect.calculate_collision_time(other)
+            if collision_time < 0 or collision_time > time_delta:
+                continue
+            effect.has_collision = True
+            effect.collisions[id(other)] = CollisionEvent(effect, other, collision_time)
+            other.has_collision = True
+            other.collisions[id(effect)] = CollisionEvent(other, effect, collision_time)
+        self.solver.solve(self.store, collidables, pairs, time_delta)
+
+    def _attach(self, effect):
+        if effect.store is not None:
+            effect = effect.clone()
+        effect.attach(self.store)
+        self.store.prev_pos[effect.slot] = self.store.position[effect.slot]
+        effect.spawn_order = self.attached
+        self.attached += 1
+        self.effects[effect] = None
+        self.fields.track(effect)
         
     
     def clone(self):
         effects = []
         for effect in self.effects:
             effects.append(effect.clone())
-        return PhysicsEngine(effects)
+        return PhysicsEngine(effects, self.max_particles, self.eviction, self.cull_margin,
+                             self.step_rate, self.max_substeps, self.seeds)
+
+    def stats(self):
+        return {
+            "particles": len(self.effects),
+            "max particles": self.max_particles,
+            "eviction": self.eviction,
+            "culled": self.culled,
+            "evicted": self.evicted,
+            "collisions": self.solver.events,
+            "step rate": self.step_rate,
+            "substeps": self.substeps,
+            "dropped steps": self.dropped_steps
+        }
     
 
+def splat_particles(particles, N, alpha=None):
+    result = np.zeros((N, 4), dtype=np.float64)
+    if len(particles) == 0:
+        return result
+
+    store = particles[0].store
+    slots = np.array([particle.slot for particle in particles], dtype=np.int64)
+    position = store.position[slots]
+    if alpha is not None:
+        prev_pos = store.prev_pos[slots]
+        position = prev_pos + (position - prev_pos) * alpha
+    radius = store.radius[slots]
+    brightness = store.brightness[slots]
+    sizes = np.array([particle.N for particle in particles], dtype=np.int64)
+
+    palettes = [colors_to_array(particle.colors) for particle in particles]
+    palette_offsets = np.cumsum([0] + [len(palette) for palette in palettes[:-1]])
+    palette = np.concatenate(palettes)
+
+    lit = radius > 0
+    radius = np.where(lit, radius, 1)
+    kernels = KERNEL_CACHE.lookup_all(radius.tolist(), sizes.tolist())
+    cached = np.flatnonzero(kernels >= 0)
+    overflow = np.flatnonzero(kernels < 0)
+    rows = KERNEL_CACHE.rows(kernels[cached], position[cached])
+    hits = [kernel_hits(cached, rows, KERNEL_CACHE.steps(), position, lit, N)]
+    if len(overflow) > 0:
+        rows, steps = evaluate_kernels(radius[overflow], sizes[overflow], position[overflow])
+        hits.append(kernel_hits(overflow, rows, steps, position, lit, N))
+    owner = np.concatenate([hit[0] for hit in hits])
+    x = np.concatenate([hit[1] for hit in hits])
+    index = np.concatenate([hit[2] for hit in hits])
+    if len(owner) == 0:
+        return result
+
+    colors = palette[palette_offsets[owner] + index].astype(np.float64)
+    scale = brightness[owner]
+    for channel in range(3):
+        contribution = np.clip(np.trunc(scale * np.trunc(colors[:, channel])), 0, 255)
+        result[:, channel] = np.bincount(x, weights=contribution, minlength=N)
+    alpha = np.clip(scale * colors[:, 3], 0, 1)
+    result[:, 3] = np.bincount(x, weights=alpha, minlength=N)
+
+    result[:, :3] = np.minimum(result[:, :3], 255)
+    result[:, 3] = np.minimum(result[:, 3], 1)
+    return result
+
+
+def kernel_hits(group, rows, steps, position, lit, N):
+    x = np.floor(position[group]).astype(np.int64)[:, None] + steps[None, :]
+    visible = (rows >= 0) & (x >= 0) & (x < N) & lit[group][:, None]
+    owner = np.broadcast_to(group[:, None], rows.shape)[visible]
+    return owner, x[visible], rows[visible]
+
+
+def sweep_pairs(store, slots):
+    if len(slots) < 2:
+        return []
+    slots = np.array(slots, dtype=np.int64)
+    prev_pos = store.prev_pos[slots]
+    position = store.position[slots]
+    low = np.minimum(prev_pos, position)
+    high = np.maximum(prev_pos, position)
+
+    order = np.argsort(low, kind="stable")
+    low = low[order]
+    high = high[order]
+    end = np.searchsorted(low, high, side="right")
+    counts = np.maximum(end - np.arange(len(slots)) - 1, 0)
+    total = counts.sum()
+    if total == 0:
+        return []
+
+    first = np.repeat(np.arange(len(slots)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    second = first + 1 + offsets
+    return zip(order[first].tolist(), order[second].tolist())
+
+
+class FieldRegistry:
+    def __init__(self):
+        self.sources = {}
+        self.forces = {}
+        self.owned = {}
+
+    def track(self, effect):
+        for behavior in getattr(effect, "behaviors", []):
+            if isinstance(behavior, FieldBehavior):
+                self.add_source(behavior, effect)
+            elif isinstance(behavior, ForceBehavior):
+                self.add_force(behavior, effect)
+
+    def add_source(self, field, particle):
+        self._add(self.sources, field, particle)
+
+    def add_force(self, force, particle):
+        self._add(self.forces, force, particle)
+
+    def _add(self, registry, behavior, particle):
+        entries = registry.setdefault(behavior.name, {})
+        key = (behavior, particle)
+        if key in entries:
+            return
+        entries[key] = key
+        self.owned.setdefault(particle, []).append((registry, behavior.name, key))
+
+    def forget(self, particle):
+        for registry, name, key in self.owned.pop(particle, []):
+            entries = registry[name]
+            del entries[key]
+            if len(entries) == 0:
+                del registry[name]
+
+    def apply(self, store, time_delta):
+        for particle in [particle for particle in self.owned if particle.store is not store]:
+            self.forget(particle)
+        for name, forces in self.forces.items():
+            sources = self.sources.get(name)
+            if sources is None:
+                continue
+            source_slots = np.array([particle.slot for _, particle in sources.values()], dtype=np.int64)
+            strength = np.array([field.constant for field, _ in sources.values()], dtype=np.float64)
+            degree = np.array([field.degree for field, _ in sources.values()], dtype=np.float64)
+            slots = np.array([particle.slot for _, particle in forces.values()], dtype=np.int64)
+            constant = np.array([force.constant for force, _ in forces.values()], dtype=np.float64)
+            vel_mult = np.array([force.vel_mult for force, _ in forces.values()], dtype=np.float64)
+
+            d = store.position[source_slots][None, :] - store.position[slots][:, None]
+            r = np.abs(d)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                field = np.where(r > 0, d * strength / np.power(r, degree + 1), 0)
+            mass = store.mass[slots]
+            force = field.sum(axis=1) * (constant + vel_mult * store.velocity[slots])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                acc = np.where(mass != 0, force / mass, 0)
+            np.add.at(store.velocity, slots, acc * time_delta)
+
+
+def collision_time(delta_pos, delta_vel, delta_acc):
+    if delta_acc != 0:
+        discrim = delta_vel * delta_vel - 2 * delta_acc * delta_pos
+        if discrim < 0:
+            return -1
+        sqrt_discrim = math.sqrt(discrim)
+
+        first, second = sorted(((-delta_vel - sqrt_discrim) / delta_acc,
+                                (-delta_vel + sqrt_discrim) / delta_acc))
+        delta_t = first if first >= 0 else second
+    elif delta_vel != 0:
+        delta_t = -delta_pos / delta_vel
+    else:
+        return -1
+
+    if delta_t < 0:
+        return -1
+    return delta_t
+
+
+class CollisionSolver:
+    def __init__(self):
+        self.events = 0
+
+    def solve(self, store, collidables, pairs, time_delta):
+        responders = [effect.rigid_behavior() for effect in collidables]
+        if all(responder is None for responder in responders):
+            return
+
+        slots = np.array([effect.slot for effect in collidables], dtype=np.int64)
+        self.collidables = collidables
+        self.responders = responders
+        self.time = [0.0] * len(collidables)
+        self.position = store.prev_pos[slots].tolist()
+        self.velocity = store.prev_vel[slots].tolist()
+        self.acceleration = store.acceleration[slots].tolist()
+        self.mass = store.mass[slots].tolist()
+        self.version = [0] * len(collidables)
+        self.low, self.high = self._reach(np.arange(len(collidables)), time_delta)
+        self.queue = []
+        resolved = set()
+
+        for i, j in self._interacting(pairs):
+            self._predict(min(i, j), max(i, j), 0, time_delta)
+
+        moved = set()
+        while len(self.queue) > 0:
+            t, i, j, version_i, version_j = heapq.heappop(self.queue)
+            if version_i != self.version[i] or version_j != self.version[j] or (i, j) in resolved:
+                continue
+            self._advance(i, t)
+            self._advance(j, t)
+            u_i = self.velocity[i]
+            u_j = self.velocity[j]
+            if responders[i] is not None and responders[i].responds_to(collidables[j]):
+                self.velocity[i] = responders[i].respond(self.mass[i], u_i, self.mass[j], u_j)
+            if responders[j] is not None and responders[j].responds_to(collidables[i]):
+                self.velocity[j] = responders[j].respond(self.mass[j], u_j, self.mass[i], u_i)
+            self.version[i] += 1
+            self.version[j] += 1
+            bodies = np.array([i, j])
+            self.low[bodies], self.high[bodies] = self._reach(bodies, time_delta)
+            resolved.add((i, j))
+            moved.update((i, j))
+            self.events += 1
+
+            for body in (i, j):
+                for other in self._partners(body):
+                    pair = (min(body, other), max(body, other))
+                    if pair not in resolved:
+                        self._predict(pair[0], pair[1], t, time_delta)
+
+        for k in moved:
+            self._advance(k, time_delta)
+            store.position[slots[k]] = self.position[k]
+            store.velocity[slots[k]] = self.velocity[k]
+        self.collidables = self.responders = self.low = self.high = self.queue = None
+
+    def _interacting(self, pairs):
+        if len(pairs) == 0 or not TAGS.fits_int64():
+            return [(i, j) for i, j in pairs if self._interacts(i, j)]
+        first, second = np.array(pairs, dtype=np.int64).T
+        masks = np.array([effect.tag_mask for effect in self.collidables], dtype=np.int64)
+        needs = np.array([0 if responder is None else responder.filter.mask
+                          for responder in self.responders], dtype=np.int64)
+        rigid = np.array([responder is not None for responder in self.responders])
+        counted = np.array([responder is not None and len(responder.filter.counters) > 0
+                            for responder in self.responders])
+
+        def accepts(a, b):
+            return rigid[a] & ((needs[a] & masks[b]) == needs[a])
+
+        candidate = accepts(first, second) | accepts(second, first)
+        exact = candidate & ~(counted[first] | counted[second])
+        interacting = list(zip(first[exact].tolist(), second[exact].tolist()))
+        for k in np.flatnonzero(candidate & ~exact).tolist():
+            i, j = int(first[k]), int(second[k])
+            if self._interacts(i, j):
+                interacting.append((i, j))
+        return interacting
+
+    def _interacts(self, i, j):
+        a, b = self.collidables[i], self.collidables[j]
+        return ((self.responders[i] is not None and self.responders[i].responds_to(b))
+                or (self.responders[j] is not None and self.responders[j].responds_to(a)))
+
+    def _partners(self, i):
+        overlapping = np.flatnonzero((self.low <= self.high[i]) & (self.high >= self.low[i]))
+        return [j for j in overlapping.tolist() if j != i and self._interacts(i, j)]
+
+    def _reach(self, bodies, time_delta):
+        position = np.array([self.position[k] for k in bodies], dtype=np.float64)
+        velocity = np.array([self.velocity[k] for k in bodies], dtype=np.float64)
+        acceleration = np.array([self.acceleration[k] for k in bodies], dtype=np.float64)
+        remaining = time_delta - np.array([self.time[k] for k in bodies], dtype=np.float64)
+        end = position + (velocity + acceleration * remaining / 2) * remaining
+        with np.errstate(divide="ignore", invalid="ignore"):
+            apex = np.where(acceleration != 0, -velocity / acceleration, 0)
+        turn = np.where((apex > 0) & (apex < remaining), position + velocity * apex / 2, position)
+        low = np.minimum(np.minimum(position, end), turn)
+        high = np.maximum(np.maximum(position, end), turn)
+        return low - REACH_SLACK, high + REACH_SLACK
+
+    def _state(self, i, t):
+        dt = t - self.time[i]
+        acceleration = self.acceleration[i]
+        return (self.position[i] + (self.velocity[i] + acceleration * dt / 2) * dt,
+                self.velocity[i] + acceleration * dt)
+
+    def _advance(self, i, t):
+        self.position[i], self.velocity[i] = self._state(i, t)
+        self.time[i] = t
+
+    def _predict(self, i, j, now, time_delta):
+        position_i, velocity_i = self._state(i, now)
+        position_j, velocity_j = self._state(j, now)
+        delta_t = collision_time(position_j - position_i, velocity_j - velocity_i,
+                                 self.acceleration[j] - self.acceleration[i])
+        if delta_t < 0 or now + delta_t > time_delta:
+            return
+        heapq.heappush(self.queue, (now + delta_t, i, j, self.version[i], self.version[j]))
+
+
 class CollisionEvent:
     def __init__(self, particleA, particleB, collision_time):
         self.particle = particleA
@@ -79,7 +544,17 @@ class CollisionEvent:
 
 
 class PhysicsBody:
+    position = StoredField()
+    velocity = StoredField()
+    acceleration = StoredField()
+    mass = StoredField()
+    prev_pos = StoredField()
+    prev_vel = StoredField()
+    stored_fields = ("position", "velocity", "acceleration", "mass", "prev_pos", "prev_vel")
+
     def __init__(self, pos, vel, acc, mass=1):
+        self.store = None
+        self.slot = None
         self.position = pos
         self.velocity = vel
         self.acceleration = acc
@@ -95,86 +570,124 @@ class PhysicsBody:
         self.prev_vel = self.velocity
         self.position += (self.velocity + self.acceleration * time_delta  / 2) * time_delta
         self.velocity += self.acceleration * time_delta
+
+    def attach(self, store):
+        values = [getattr(self, name) for name in self.stored_fields]
+        self.store = store
+        self.slot = store.allocate()
+        for name, value in zip(self.stored_fields, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def bound(cls, store, slot):
+        body = cls.__new__(cls)
+        body.store = store
+        body.slot = slot
+        return body
+
+    def spawn_batch(self, store, slots, rng):
+        store.position[slots] = store.prev_pos[slots] = self.position
+        store.velocity[slots] = store.prev_vel[slots] = self.velocity
+        store.acceleration[slots] = self.acceleration
+        store.mass[slots] = self.mass
+        return [PhysicsBody.bound(store, slot) for slot in slots.tolist()]
+
+    def detach(self):
+        if self.store is None:
+            return
+        values = [getattr(self, name) for name in self.stored_fields]
+        self.store.release(self.slot)
+        self.store = None
+        self.slot = None
+        for name, value in zip(self.stored_fields, values):
+            setattr(self, name, value)
         
     def clone(self):
         return PhysicsBody(self.position, self.velocity, self.acceleration, self.mass)
 
 
 class PhysicsEffect(BaseEffect):
+    stored_fields = ()
+
     def __init__(self, body, collidable=False, tags=[], bounds=3):
         super().__init__()
         self.body = body
         self.is_alive = True
         self.collidable = collidable
         self.tags = set(tags)
+        self.tag_mask, self.tag_counters = tag_signature(self.tags)
         self.has_collision = False
-        self.notify_collision = False
         self.collisions = {}
-        self.notify_collisions = {}
         self.bounds = bounds
+        self.spawn_order = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["tag_mask"], state["tag_counters"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.tag_mask, self.tag_counters = tag_signature(self.tags)
+
+    @property
+    def store(self):
+        return self.body.store
+
+    @property
+    def slot(self):
+        return self.body.slot
+
+    def attach(self, store):
+        values = [getattr(self, name) for name in self.stored_fields]
+        self.body.attach(store)
+        for name, value in zip(self.stored_fields, values):
+            setattr(self, name, value)
+
+    def detach(self):
+        values = [getattr(self, name) for name in self.stored_fields]
+        self.body.detach()
+        for name, value in zip(self.stored_fields, values):
+            setattr(self, name, value)
 
     def tick(self, engine, _, time_delta):
         if not self.is_alive:
             return
-        self.body.tick(time_delta)
-        if self.collidable:
-            self.has_collision = self.notify_collision
-            self.collisions = self.notify_collisions
-            self.notify_collision = False
-            self.notify_collisions = {}
-            self.detect_collision(engine, time_delta)
-        
-    def detect_collision(self, engine, time_delta):        
-        a = min(self.body.prev_pos, self.body.position)
-        b = max(self.body.prev_pos, self.body.position)
-        
-        for other_effect in engine.effects:
-            if other_effect is self or not other_effect.collidable or id(other_effect) in self.collisions:
-                continue
-            if a < other_effect.body.position <= b:
-                collision_time = self.calculate_collision_time(other_effect)
-                if collision_time < 0 or collision_time > time_delta:
-                    continue
-                
-                self.has_collision = True
-                self.collisions[id(other_effect)] = CollisionEvent(self, other_effect, collision_time)
-                other_effect.notify_collision = True
-                other_effect.notify_collisions[id(self)] = CollisionEvent(other_effect, self, collision_time)
-                
-    
-    def calculate_collision_time(self, other):
-        delta_pos = other.body.prev_pos - self.body.prev_pos
-        delta_vel = other.body.prev_vel - self.body.prev_vel
-        delta_acc = other.body.acceleration - self.body.acceleration
-        
-        if delta_acc != 0:
-            discrim = delta_vel * delta_vel - 2 * delta_acc * delta_pos
-            if discrim < 0:
-                return -1
-            sqrt_discrim = math.sqrt(discrim)
-            
-            delta_t = (-delta_vel - sqrt_discrim) / delta_acc
-            if delta_t < 0:
-                delta_t = (-delta_vel + sqrt_discrim) / delta_acc
-        elif delta_vel != 0:
-            delta_t = -delta_pos / delta_vel           
-        else:
-            return -1
+        if self.body.store is not engine.store:
+            self.body.tick(time_delta)
         
-        if delta_t < 0:
-            return -1
-        return delta_t
+    def calculate_collision_time(self, other):
+        return collision_time(other.body.prev_pos - self.body.prev_pos,
+                              other.body.prev_vel - self.body.prev_vel,
+                              other.body.acceleration - self.body.acceleration)
+
+    def rigid_behavior(self):
+        return None
                 
         
+    def is_cullable(self):
+        return True
+
     def get_pixel(self, index):
         return (0, 0, 0, 0)
 
+    def get_pixels(self, N):
+        position = self.body.position
+        left = max(0, math.floor(position - self.bounds))
+        right = min(N - 1, math.ceil(position + self.bounds))
+        for x in range(left, right + 1):
+            yield x, self.get_pixel(x)
+
     def clone(self):
         tags = [tag.clone() for tag in self.tags]
-        return PhysicsEffect(self.body, self.collidable, tags=tags, bounds=self.bounds)
+        return PhysicsEffect(self.body.clone(), self.collidable, tags=tags, bounds=self.bounds)
 
 
 class ParticleEffect(PhysicsEffect):
+    brightness = StoredField()
+    radius = StoredField()
+    stored_fields = ("brightness", "radius")
+
     def __init__(self, effect, pbody, radius, behaviors=[], collidable=False, tags=[]):
         super().__init__(pbody, collidable, tags, int(3 * radius + 1))
         self.effect = effect
@@ -188,13 +701,18 @@ class ParticleEffect(PhysicsEffect):
         self.new_behaviors = []
         
         self.brightness = 1
+        self.prototype = None
         
     def tick(self, engine, colors, time_delta):
         super().tick(engine, colors, time_delta)
         if self.N < 5 or self.effect.type == DYNAMIC:
-            self.colors = resize_clone(colors, min(len(colors), math.ceil(10 * self.radius + 5)))
+            size = min(len(colors), math.ceil(10 * self.radius + 5))
+            if self.prototype is not None and self.prototype.shares_palette:
+                self.colors = self.prototype.palette(colors, size, time_delta)
+            else:
+                self.colors = resize_clone(colors, size)
+                self.effect.tick(self.colors, time_delta)
             self.N = len(self.colors) - 1
-            self.effect.tick(self.colors, time_delta)
         
         self.tick_behaviors(engine, time_delta)
         
@@ -213,22 +731,44 @@ class ParticleEffect(PhysicsEffect):
         
     def get_pixel(self, index):
         return self.gaussian_blur((self.body.position - index))
+
+    def get_pixels(self, N):
+        position = self.body.position
+        radius = self.radius
+        brightness = self.brightness
+        left = max(0, math.floor(position - self.bounds))
+        right = min(N - 1, math.ceil(position + self.bounds))
+        for x in range(left, right + 1):
+            yield x, self._blur(position - x, radius, brightness)
     
     def gaussian_blur(self, dx):
-        if self.radius <= 0 or abs(dx) >= 3 * self.radius:
+        return self._blur(dx, self.radius, self.brightness)
+
+    def _blur(self, dx, radius, brightness):
+        if radius <= 0 or abs(dx) >= 3 * radius:
             return (0, 0, 0, 0)
         x2 = dx * dx
-        s2 = self.radius * self.radius
+        s2 = radius * radius
         G = math.exp(- x2 / (2 * s2))
         
         val = G * self.N
         if val < 1:
             return (0, 0, 0, 0)
-        return scalar_mult(self.brightness, self.colors[self.N - int(val)])
+        return scalar_mult(brightness, self.colors[self.N - int(val)])
 
     def add_behavior(self, behavior):
         self.new_behaviors.append(behavior)
 
+    def is_cullable(self):
+        return all(behavior.is_cullable() for behavior in self.behaviors) and \
+            all(behavior.is_cullable() for behavior in self.new_behaviors)
+
+    def rigid_behavior(self):
+        for behavior in self.behaviors:
+            if isinstance(behavior, RigidColliderBehavior):
+                return behavior
+        return None
+
     def clone(self):
         effect = self.effect.clone()
         body = self.body.clone()
@@ -236,15 +776,68 @@ class ParticleEffect(PhysicsEffect):
         for behavior in self.init_behaviors:
             behaviors.append(behavior.clone())
         tags = [tag.clone() for tag in self.tags]
-        return ParticleEffect(effect, body, self.radius, behaviors, self.collidable, tags)
+        copy = ParticleEffect(effect, body, self.radius, behaviors, self.collidable, tags)
+        copy.prototype = self.prototype
+        return copy
     
 
+def shares_clones(effect):
+    if effect.type != STATIC or not effect.fold_children:
+        return False
+    return all(shares_clones(child) for child in effect.children())
+
+
+class ParticlePrototype:
+    def __init__(self, template):
+        self.template = template
+        self.compiled = isinstance(template, ParticleEffect)
+        if not self.compiled:
+            return
+        self.effect = template.effect if shares_clones(template.effect) else None
+        self.shares_palette = self.effect is not None and not self.effect.reads_input()
+        self.palettes = {}
+        self.behaviors = [(behavior, behavior.is_stateless()) for behavior in template.init_behaviors]
+        self.tags = [(tag, isinstance(tag, CountingTag)) for tag in template.tags]
+
+    def spawn(self):
+        if not self.compiled:
+            return self.template.clone()
+        return self._instance(self.template.body.clone())
+
+    def spawn_batch(self, store, slots, rng):
+        bodies = self.template.body.spawn_batch(store, slots, rng)
+        return [self._instance(body) for body in bodies]
+
+    def _instance(self, body):
+        template = self.template
+        effect = self.effect if self.effect is not None else template.effect.clone()
+        behaviors = [behavior if stateless else behavior.clone() for behavior, stateless in self.behaviors]
+        tags = [tag.clone() if counting else tag for tag, counting in self.tags]
+        particle = ParticleEffect(effect, body, template.radius, behaviors, template.collidable, tags)
+        particle.prototype = self
+        return particle
+
+    def palette(self, colors, size, time_delta):
+        palette = self.palettes.get(size)
+        if palette is None:
+            palette = resize_clone(colors, size)
+            self.effect.tick(palette, time_delta)
+            self.palettes[size] = palette
+        return palette
+
+
 class ParticleBehavior():
     def __init__(self):
         self.is_alive = True
     
     def tick(self, engine, particle, time_delta):
         pass
+
+    def is_stateless(self):
+        return False
+
+    def is_cullable(self):
+        return True
     
     def clone(self):
         raise NotImplementedError()
@@ -257,6 +850,7 @@ class EmitterBehavior(ParticleBehavior):
         self.density = density
         self.time_sum = 0
         self.particle_emitted = 0
+        self.prototype = None
     
     def tick(self, engine, particle, time_delta):
         self.time_sum += time_delta
@@ -265,10 +859,15 @@ class EmitterBehavior(ParticleBehavior):
             self.particle_emitted += 1
             
     def emit(self, engine, particle):
-        emission = self.emission.clone()
+        if self.prototype is None:
+            self.prototype = ParticlePrototype(self.emission)
+        emission = self.prototype.spawn()
         emission.body.position += particle.body.position
         emission.body.velocity += particle.body.velocity
         engine.add_effect(emission)
+
+    def is_cullable(self):
+        return False
         
     def clone(self):
         return EmitterBehavior(self.emission.clone(), self.density)
@@ -282,6 +881,7 @@ class ExplosionBehavior(ParticleBehavior):
         self.fuse = fuse
         self.time_sum = 0
         self.explosions = 0
+        self.prototype = None
         
     def tick(self, engine, particle, time_delta):
         self.time_sum += time_delta
@@ -290,11 +890,12 @@ class ExplosionBehavior(ParticleBehavior):
             self.explosions += 1
         
     def explode(self, engine, particle):
-        for _ in range(self.density):
-            emission = self.emission.clone()
-            emission.body.position += particle.body.position
-            emission.body.velocity += particle.body.velocity
-            engine.add_effect(emission)
+        if self.prototype is None:
+            self.prototype = ParticlePrototype(self.emission)
+        engine.spawn_batch(self.prototype, self.density, particle.body.position, particle.body.velocity)
+
+    def is_cullable(self):
+        return False
             
     def clone(self):
         return ExplosionBehavior(self.emission.clone(), self.density, self.fuse)
@@ -307,12 +908,13 @@ class CollisionBehavior(ParticleBehavior):
         self.once = once
         self.fired = False
         self.tags = set(tags)
+        self.filter = TagFilter(self.tags)
     
     def tick(self, engine, particle, time_delta):
         if not particle.has_collision or (self.once and self.fired and particle.is_alive):
             return
         for collider, collision in particle.collisions.items():
-            if (not self.once or not self.fired) and particle.is_alive and self.tags.issubset(collision.other.tags):
+            if (not self.once or not self.fired) and particle.is_alive and self.filter.matches(collision.other):
                 for behavior in self.behaviors:
                     b = behavior.clone()
                     b.tick(engine, particle, time_delta)
@@ -320,6 +922,9 @@ class CollisionBehavior(ParticleBehavior):
                 self.fired = True
         if self.once and self.fired:
             self.is_alive = False
+
+    def is_cullable(self):
+        return all(behavior.is_cullable() for behavior in self.behaviors)
     
     def clone(self):
         behaviors = [behavior.clone() for behavior in self.behaviors]
@@ -332,40 +937,22 @@ class RigidColliderBehavior(ParticleBehavior):
         super().__init__()
         self.coeff_res = coeff_restitution
         self.tags = set(tags)
+        self.filter = TagFilter(self.tags)
         
-    def tick(self, engine, particle, time_delta):
-        if not particle.has_collision:
-            return
-        
-        min_time = None
-        for collider, collision in particle.collisions.items():
-            if self.tags.issubset(collision.other.tags) and (min_time is None or collision.collision_time < min_time.collision_time):
-                min_time = collision
-        self.calculate_post_collision(particle, min_time, time_delta)
-                
-    def calculate_post_collision(self, particle, collision, time_delta):
-        if collision is None:
-            return
-        m1 = collision.bodyA.mass
-        m2 = collision.bodyB.mass
+    def responds_to(self, other):
+        return self.filter.matches(other)
+
+    def respond(self, m1, u1, m2, u2):
         mass_sum = m1 + m2
         if mass_sum <= 0:
-            return
-        
-        remaining_time_delta = time_delta - collision.collision_time
-        
-        pos = collision.bodyA.prev_pos
-        u1 = collision.bodyA.prev_vel
-        u2 = collision.bodyB.prev_vel
-        u_d = u2 - u1
-        p1 = m1 * u1
-        p2 = m2 * u2
-        
-        vel = (self.coeff_res * m2 * u_d + p1 + p2) / mass_sum
-        
-        particle.body.position = pos
-        particle.body.velocity = vel
-        particle.body.tick(remaining_time_delta)
+            return u1
+        return (self.coeff_res * m2 * (u2 - u1) + m1 * u1 + m2 * u2) / mass_sum
+
+    def is_stateless(self):
+        return len(self.filter.counters) == 0
+
+    def is_cullable(self):
+        return False
         
     def clone(self):
         return RigidColliderBehavior(self.coeff_res, [tag.clone() for tag in self.tags])
@@ -429,22 +1016,12 @@ class FieldBehavior(ParticleBehavior):
         self.name = name
         self.constant = constant
         self.degree = degree
-        self.position = 0
         
     def tick(self, engine, particle, time_delta):
-        if "FIELDS" not in engine.components:
-            engine.components["FIELDS"] = {}
-        if self.name not in engine.components["FIELDS"]:
-            engine.components["FIELDS"][self.name] = set()
-        if self not in engine.components["FIELDS"][self.name]:
-            engine.components["FIELDS"][self.name].add(self)
-        self.position = particle.body.position
-            
-    def get_field_value(self, position):
-        d = self.position - position
-        r = abs(self.position - position)
-        val = d * self.constant / math.pow(r, self.degree + 1)
-        return val
+        engine.fields.add_source(self, particle)
+
+    def is_cullable(self):
+        return False
     
     def clone(self):
         return FieldBehavior(self.name, self.constant, self.degree)
@@ -458,34 +1035,87 @@ class ForceBehavior(ParticleBehavior):
         self.vel_mult = velocity_mult
     
     def tick(self, engine, particle, time_delta):
-        if "FIELDS" not in engine.components:
-            return
-        if self.name not in engine.components["FIELDS"]:
-            return
-        force = 0
-        value = self.constant + (self.vel_mult * particle.body.velocity)
-        
-        dead_fields = set()
-        for field in engine.components["FIELDS"][self.name]:
-            if not field.is_alive: 
-                dead_fields.add(field)
-            force += field.get_field_value(particle.body.position)
-        for field in dead_fields:
-            engine.components["FIELDS"][self.name].remove(field)
-        
-        force *= value
-        acc = force / particle.body.mass
-        at = acc * time_delta
-        # particle.body.position += at * time_delta / 2 # requires more calculus to be correct
-        particle.body.velocity += at
+        engine.fields.add_force(self, particle)
+
+    def is_stateless(self):
+        return True
+
+    def is_cullable(self):
+        return False
         
     def clone(self):
         return ForceBehavior(self.name, self.constant, self.vel_mult)
     
     
+class TagRegistry:
+    def __init__(self):
+        self.bits = {}
+        self.prefixes = {}
+
+    def bit(self, string):
+        index = self.bits.get(string)
+        if index is None:
+            index = self.bits[string] = len(self.bits)
+        return 1 << index
+
+    def counter(self, prefix, count):
+        index = self.prefixes.get(prefix)
+        if index is None:
+            index = self.prefixes[prefix] = len(self.prefixes)
+        return (index << 32) | (count & 0xFFFFFFFF)
+
+    def fits_int64(self):
+        return len(self.bits) < 63
+
+
+TAGS = TagRegistry()
+
+
+def tag_signature(tags):
+    mask = 0
+    counters = []
+    for tag in tags:
+        if isinstance(tag, str):
+            mask |= TAGS.bit(tag)
+            continue
+        mask |= tag.bit
+        if tag.counter is not None:
+            counters.append(tag.counter)
+    return mask, frozenset(counters)
+
+
+class TagFilter:
+    def __init__(self, tags):
+        self.tags = tags
+        self.mask, self.counters = tag_signature(tags)
+
+    def __getstate__(self):
+        return {"tags": self.tags}
+
+    def __setstate__(self, state):
+        self.__init__(state["tags"])
+
+    def matches(self, effect):
+        return effect.tag_mask & self.mask == self.mask and self.counters <= effect.tag_counters
+
+
 class Tag:
     def __init__(self, string):
         self.string = string
+        self._intern()
+
+    def _intern(self):
+        self.bit = TAGS.bit(self.string)
+        self.counter = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["bit"], state["counter"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._intern()
         
     def __repr__(self):
         return self.string
@@ -500,15 +1130,19 @@ class Tag:
         return self.string.__hash__() 
         
     def clone(self):
-        return Tag(self.string)
+        return self
     
 
 class CountingTag(Tag):
     def __init__(self, start=0, prefix=""):
-        super().__init__(f"{prefix}-{start}")
         self.start = start
         self.prefix = prefix
         self.count = start
+        super().__init__(f"{prefix}-{start}")
+
+    def _intern(self):
+        self.bit = 0
+        self.counter = TAGS.counter(self.prefix, self.start)
         
     def __repr__(self):
         return self.string
@@ -4,6 +4,8 @@ from .effects import BaseEffect, DYNAMIC
 
 
 class CropEffect(BaseEffect):
+    child_attributes = ("effect",)
+
     def __init__(self, effect, size, offset=0):
         super().__init__(effect.type)
         self.effect = effect
@@ -18,27 +20,35 @@ class CropEffect(BaseEffect):
         for i in range(0, self.size):
             pixels[(i + self.offset) % N] = colors[i]
     
+    def reads_input(self):
+        return True
+
+    def get_period(self):
+        return self.effect.get_period()
+
     def clone(self):
         return CropEffect(self.effect.clone(), self.size, self.offset)
     
 
 class ResizeEffect(BaseEffect):
+    child_attributes = ("effect",)
+
     def __init__(self, effect, size):
         super().__init__(effect.type)
         self.effect = effect
         self.size = size
-        self.colors = None
     
     def tick(self, pixels, time_delta):
         N = len(pixels)
         ratio = (N - 1) / (self.size - 1)
         
-        if self.colors is None or self.effect.type == DYNAMIC:
-            self.colors = resize_clone(pixels, self.size)
-            self.effect.tick(self.colors, time_delta)
+        colors = resize_clone(pixels, self.size)
+        self.effect.tick(colors, time_delta)
         
-        for i in range(N):
-            pixels[i] = self.colors[int(i / ratio)]
+        gather_pixels(pixels, colors, (np.arange(N) / ratio).astype(np.int64))
+
+    def get_period(self):
+        return self.effect.get_period()
             
     def clone(self):
         return ResizeEffect(self.effect.clone(), self.size)
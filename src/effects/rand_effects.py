@@ -1,15 +1,21 @@
 import math
 from ..color_utils import *
 from .effects import DYNAMIC, STATIC, BaseEffect, is_all_static
-import random
+import numpy as np
 from .physics_effects import PhysicsBody
 
 class RandChoice(BaseEffect):
-    def __init__(self, effects, rerolls=-1) -> None:
+    child_attributes = ("effect",)
+    fold_children = False
+
+    def __init__(self, effects, rerolls=-1, rng=None) -> None:
         super().__init__(is_all_static(effects))
+        if rng is None:
+            rng = np.random.default_rng()
         self.effects = effects
         self.rerolls = rerolls
-        self.effect = random.choice(self.effects)
+        self.rng = rng
+        self.effect = self.effects[int(rng.integers(len(self.effects)))]
         self.type = self.effect.type
         
     def tick(self, pixels, time_delta):
@@ -17,18 +23,24 @@ class RandChoice(BaseEffect):
         
     def clone(self):
         if self.rerolls != 0:
-            return RandChoice(self.effects.copy(), self.rerolls - 1)
+            return RandChoice(self.effects.copy(), self.rerolls - 1, self.rng)
         else:
             return self.effect.copy()
 
 
 class RandTime(BaseEffect):
-    def __init__(self, effect, lower, upper, rerolls=-1) -> None:
+    child_attributes = ("effect",)
+    fold_children = False
+
+    def __init__(self, effect, lower, upper, rerolls=-1, rng=None) -> None:
         super().__init__(effect.type)
+        if rng is None:
+            rng = np.random.default_rng()
         self.effect = effect
         self.lower = lower
         self.upper = upper
-        self.time = random.random() * (upper - lower) + lower
+        self.rng = rng
+        self.time = rng.random() * (upper - lower) + lower
         self.first_tick = True
         self.rerolls = rerolls
     
@@ -41,20 +53,26 @@ class RandTime(BaseEffect):
         
     def clone(self):
         if self.rerolls != 0:
-            return RandTime(self.effect.clone(), self.lower, self.upper, self.rerolls - 1)
+            return RandTime(self.effect.clone(), self.lower, self.upper, self.rerolls - 1, self.rng)
         else:
-            copy = RandTime(self.effect.clone(), self.lower, self.upper)
+            copy = RandTime(self.effect.clone(), self.lower, self.upper, rng=self.rng)
             copy.time = self.time
             return copy
         
 
 class RandWarp(BaseEffect):
-    def __init__(self, effect, lower, upper, rerolls=-1) -> None:
+    child_attributes = ("effect",)
+    fold_children = False
+
+    def __init__(self, effect, lower, upper, rerolls=-1, rng=None) -> None:
         super().__init__(effect.type)
+        if rng is None:
+            rng = np.random.default_rng()
         self.effect = effect
         self.lower = lower
         self.upper = upper
-        self.warp = random.random() * (upper - lower) + lower
+        self.rng = rng
+        self.warp = rng.random() * (upper - lower) + lower
         self.rerolls = rerolls
     
     def tick(self, pixels, time_delta):
@@ -62,18 +80,24 @@ class RandWarp(BaseEffect):
         
     def clone(self):
         if self.rerolls != 0:
-            return RandWarp(self.effect.clone(), self.lower, self.upper, self.rerolls - 1)
+            return RandWarp(self.effect.clone(), self.lower, self.upper, self.rerolls - 1, self.rng)
         else:
-            copy = RandWarp(self.effect.clone(), self.lower, self.upper)
+            copy = RandWarp(self.effect.clone(), self.lower, self.upper, rng=self.rng)
             copy.warp = self.warp
             return copy
     
 
 class RandSelector(BaseEffect):
-    def __init__(self, effect, rerolls=-1):
+    child_attributes = ("effect",)
+    fold_children = False
+
+    def __init__(self, effect, rerolls=-1, rng=None):
         super().__init__(effect.type)
+        if rng is None:
+            rng = np.random.default_rng()
         self.effect = effect
-        self.index = random.random()
+        self.rng = rng
+        self.index = rng.random()
         self.rerolls = rerolls
         self.color = None
         
@@ -88,20 +112,24 @@ class RandSelector(BaseEffect):
     
     def clone(self):
         if self.rerolls != 0:
-            return RandSelector(self.effect.clone(), self.rerolls - 1)
+            return RandSelector(self.effect.clone(), self.rerolls - 1, self.rng)
         else:
-            copy = RandSelector(self.effect.clone(), 0)
+            copy = RandSelector(self.effect.clone(), 0, self.rng)
             copy.index = self.index
             return copy
 
 
 class RandPBody(PhysicsBody):
-    def __init__(self, min_pos, max_pos, min_vel=0, max_vel=0, min_acc=0, max_acc=0, min_mass=1, max_mass=1, rerolls=-1):
+    def __init__(self, min_pos, max_pos, min_vel=0, max_vel=0, min_acc=0, max_acc=0, min_mass=1, max_mass=1, rerolls=-1,
+                 rng=None):
+        if rng is None:
+            rng = np.random.default_rng()
+        samples = rng.random(4).tolist()
         super().__init__(
-            random.random() * (max_pos - min_pos) + min_pos,
-            random.random() * (max_vel - min_vel) + min_vel,
-            random.random() * (max_acc - min_acc) + min_acc,
-            random.random() * (max_mass - min_mass) + min_mass
+            samples[0] * (max_pos - min_pos) + min_pos,
+            samples[1] * (max_vel - min_vel) + min_vel,
+            samples[2] * (max_acc - min_acc) + min_acc,
+            samples[3] * (max_mass - min_mass) + min_mass
         )
         self.min_pos = min_pos
         self.max_pos = max_pos
@@ -112,7 +140,30 @@ class RandPBody(PhysicsBody):
         self.min_mass = min_mass
         self.max_mass = max_mass
         self.rerolls = rerolls
+        self.rng = rng
     
+    def spawn_batch(self, store, slots, rng):
+        if self.rerolls == 0:
+            return super().spawn_batch(store, slots, rng)
+        low = np.array([self.min_pos, self.min_vel, self.min_acc, self.min_mass])
+        high = np.array([self.max_pos, self.max_vel, self.max_acc, self.max_mass])
+        samples = rng.random((len(slots), 4)) * (high - low) + low
+        store.position[slots] = store.prev_pos[slots] = samples[:, 0]
+        store.velocity[slots] = store.prev_vel[slots] = samples[:, 1]
+        store.acceleration[slots] = samples[:, 2]
+        store.mass[slots] = samples[:, 3]
+
+        params = {name: getattr(self, name) for name in
+                  ("min_pos", "max_pos", "min_vel", "max_vel", "min_acc", "max_acc", "min_mass", "max_mass")}
+        params["rerolls"] = self.rerolls - 1
+        params["rng"] = self.rng
+        bodies = []
+        for slot in slots.tolist():
+            body = RandPBody.bound(store, slot)
+            body.__dict__.update(params)
+            bodies.append(body)
+        return bodies
+
     def clone(self):
         if self.rerolls != 0:
             return RandPBody(
@@ -124,7 +175,8 @@ class RandPBody(PhysicsBody):
                 self.max_acc,
                 self.min_mass,
                 self.max_mass,
-                self.rerolls - 1
+                self.rerolls - 1,
+                self.rng
             )
         else:
             return PhysicsBody(self.position, self.velocity, self.acceleration, self.mass)
@@ -0,0 +1,76 @@
+import numpy as np
+
+
+UNSET = (-1, -1, -1)
+COLOR_DTYPE = np.float64
+
+
+def to_rgba(color):
+    if len(color) < 4:
+        return (color[0], color[1], color[2], 1)
+    return (color[0], color[1], color[2], color[3])
+
+
+def colors_to_array(colors):
+    if isinstance(colors, FrameBuffer):
+        return colors.array
+    if isinstance(colors, np.ndarray):
+        return colors
+    return np.array([to_rgba(color) for color in colors], dtype=COLOR_DTYPE).reshape(-1, 4)
+
+
+def unset_mask(colors):
+    return np.all(colors[:, :3] == UNSET, axis=1)
+
+
+def coverage_of(colors):
+    if isinstance(colors, FrameBuffer):
+        return colors.covered
+    return ~unset_mask(colors_to_array(colors))
+
+
+def is_unset(color):
+    return tuple(color[:3]) == UNSET
+
+
+class FrameBuffer:
+    def __init__(self, size=0, fill=None, array=None, covered=None):
+        if array is None:
+            array = np.zeros((size, 4), dtype=COLOR_DTYPE)
+            if fill is not None:
+                array[:] = to_rgba(fill)
+        if covered is None:
+            covered = ~unset_mask(array)
+        self.array = array
+        self.covered = covered
+
+    @staticmethod
+    def from_colors(colors):
+        return FrameBuffer(array=np.array(colors_to_array(colors), dtype=COLOR_DTYPE))
+
+    def copy(self):
+        return FrameBuffer(array=self.array.copy(), covered=self.covered.copy())
+
+    def __repr__(self):
+        return f"FrameBuffer({len(self)})"
+
+    def __len__(self):
+        return len(self.array)
+
+    def __iter__(self):
+        for i in range(len(self.array)):
+            yield self[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return FrameBuffer(array=self.array[index].copy(), covered=self.covered[index].copy())
+        r, g, b, a = self.array[index].tolist()
+        return (int(r), int(g), int(b), a)
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self.array[index] = colors_to_array(value)
+            self.covered[index] = coverage_of(value)
+        else:
+            self.array[index] = to_rgba(value)
+            self.covered[index] = not is_unset(value)
@@ -0,0 +1,79 @@
+from collections import OrderedDict
+import numpy as np
+from .config import config
+from .frame_buffer import UNSET
+
+
+def ring_bytes(nframes, size):
+    return nframes * size * 5
+
+
+class FrameRing:
+    def __init__(self, nframes, size):
+        self.nframes = nframes
+        self.size = size
+        self.colors = np.empty((nframes, size, 4), dtype=np.uint8)
+        self.covered = np.empty((nframes, size), dtype=bool)
+        self.filled = 0
+        self.evicted = False
+
+    def nbytes(self):
+        return ring_bytes(self.nframes, self.size)
+
+    def store(self, index, pixels):
+        colors = pixels.array
+        self.colors[index, :, :3] = np.clip(colors[:, :3], 0, 255)
+        self.colors[index, :, 3] = np.rint(np.clip(colors[:, 3], 0, 1) * 255)
+        self.covered[index] = pixels.covered
+
+    def load(self, index, pixels):
+        colors = self.colors[index]
+        pixels.array[:, :3] = colors[:, :3]
+        pixels.array[:, 3] = colors[:, 3] / 255
+        pixels.covered[:] = self.covered[index]
+        pixels.array[~pixels.covered, :3] = UNSET
+
+
+class FrameCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.rings = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def allocate(self, nframes, size):
+        nbytes = ring_bytes(nframes, size)
+        if nbytes > self.max_bytes:
+            return None
+        while self.bytes + nbytes > self.max_bytes:
+            _, evicted = self.rings.popitem(last=False)
+            evicted.evicted = True
+            self.bytes -= evicted.nbytes()
+            self.evictions += 1
+        ring = FrameRing(nframes, size)
+        self.rings[id(ring)] = ring
+        self.bytes += nbytes
+        return ring
+
+    def touch(self, ring):
+        self.rings.move_to_end(id(ring))
+
+    def release(self, ring):
+        if id(ring) in self.rings:
+            del self.rings[id(ring)]
+            self.bytes -= ring.nbytes()
+
+    def stats(self):
+        return {
+            "rings": len(self.rings),
+            "bytes": self.bytes,
+            "max bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+
+FRAME_CACHE = FrameCache(int(config('frame cache.max mb', default=32) * 2**20))
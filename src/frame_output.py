@@ -0,0 +1,108 @@
+import threading
+import time
+import numpy as np
+from .drivers import write_frame
+
+
+class FrameOutput:
+    def __init__(self, pixels, period, buffers=3, threaded=True):
+        if buffers < 2:
+            raise Exception(f"Frame output needs at least 2 buffers, got {buffers}")
+        self.pixels = pixels
+        self.period = period
+        self.threaded = threaded
+
+        n = len(pixels)
+        self.free = [np.zeros((n, 3), dtype=np.int64) for i in range(buffers)]
+        self.pending = None
+        self.pending_time = None
+        self.brightness = None
+        self.stopped = False
+        self.condition = threading.Condition()
+
+        self.shows = 0
+        self.dropped = 0
+        self.late = 0
+        self.show_time = 0
+
+        self.thread = None
+        if threaded:
+            self.thread = threading.Thread(target=self._run, name="pixel output", daemon=True)
+            self.thread.start()
+
+    def submit(self, frame):
+        if not self.threaded:
+            self._show(frame, time.perf_counter())
+            return
+
+        with self.condition:
+            if len(self.free) > 0:
+                buffer = self.free.pop()
+            else:
+                buffer = self.pending
+                self.pending = None
+                self.dropped += 1
+        np.copyto(buffer, frame[:, :3])
+        with self.condition:
+            if self.pending is not None:
+                self.free.append(self.pending)
+                self.dropped += 1
+            self.pending = buffer
+            self.pending_time = time.perf_counter()
+            self.condition.notify()
+
+    def set_brightness(self, brightness):
+        if not self.threaded:
+            self.pixels.brightness = brightness
+            self.pixels.show()
+            return
+
+        with self.condition:
+            self.brightness = brightness
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.stopped or self.pending is not None or self.brightness is not None)
+                if self.stopped:
+                    return
+                buffer, submitted = self.pending, self.pending_time
+                brightness = self.brightness
+                self.pending = None
+                self.brightness = None
+
+            if brightness is not None:
+                self.pixels.brightness = brightness
+                if buffer is None:
+                    self.pixels.show()
+
+            if buffer is not None:
+                self._show(buffer, submitted)
+                with self.condition:
+                    self.free.append(buffer)
+
+    def _show(self, frame, submitted):
+        write_frame(self.pixels, frame)
+        self.pixels.show()
+        done = time.perf_counter()
+        self.shows += 1
+        self.show_time = done - submitted
+        if done - submitted > self.period:
+            self.late += 1
+
+    def stats(self):
+        return {
+            "shows": self.shows,
+            "dropped": self.dropped,
+            "late": self.late,
+            "output latency": self.show_time
+        }
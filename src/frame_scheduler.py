@@ -0,0 +1,127 @@
+import asyncio
+import statistics
+from collections import deque
+
+
+SKIP = "skip"
+CATCH_UP = "catchup"
+OVERRUN_POLICIES = [SKIP, CATCH_UP]
+
+
+class FrameScheduler:
+    def __init__(self, tps, overrun_policy=SKIP, max_catch_up=None, window=None):
+        if overrun_policy not in OVERRUN_POLICIES:
+            raise Exception(f"{overrun_policy} is not a valid overrun policy, must be one of {OVERRUN_POLICIES}")
+        self.tps = tps
+        self.period = 1 / tps
+        self.overrun_policy = overrun_policy
+        self.max_catch_up = max_catch_up if max_catch_up is not None else tps
+
+        self.paused = False
+        self.stopped = False
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+
+        self.deadline = None
+        self.last_frame = None
+
+        window = window if window is not None else 2 * tps
+        self.frame_times = deque(maxlen=window)
+        self.lateness = deque(maxlen=window)
+        self.frames = 0
+        self.skipped = 0
+
+    def pause(self):
+        self.paused = True
+        self.resumed.clear()
+
+    def resume(self):
+        self.paused = False
+        self.resumed.set()
+
+    def stop(self):
+        self.stopped = True
+        self.resumed.set()
+
+    def reset(self):
+        self.deadline = None
+        self.last_frame = None
+        self.frame_times.clear()
+
+    async def next_frame(self):
+        if self.paused:
+            await self.resumed.wait()
+            self.reset()
+        loop = asyncio.get_running_loop()
+
+        if self.deadline is None:
+            self.deadline = loop.time()
+        else:
+            self.deadline += self.period
+
+        now = loop.time()
+        if now < self.deadline:
+            await self._sleep_until(loop, self.deadline)
+            now = loop.time()
+        else:
+            self._handle_overrun(now)
+            await self._sleep_until(loop, now)
+            now = loop.time()
+
+        if self.last_frame is None or self.overrun_policy == CATCH_UP:
+            time_delta = self.period
+        else:
+            time_delta = now - self.last_frame
+        self.last_frame = now
+
+        self.frames += 1
+        self.frame_times.append(now)
+        self.lateness.append(now - self.deadline)
+        return time_delta
+
+    def _handle_overrun(self, now):
+        missed = int((now - self.deadline) / self.period)
+        if missed <= 0:
+            return
+        if self.overrun_policy == SKIP or missed > self.max_catch_up:
+            self.skipped += missed
+            self.deadline += missed * self.period
+
+    async def _sleep_until(self, loop, deadline):
+        future = loop.create_future()
+        handle = loop.call_at(deadline, _resolve, future)
+        try:
+            await future
+        finally:
+            handle.cancel()
+
+    def fps(self):
+        if len(self.frame_times) < 2:
+            return 0
+        elapsed = self.frame_times[-1] - self.frame_times[0]
+        if elapsed <= 0:
+            return 0
+        return (len(self.frame_times) - 1) / elapsed
+
+    def jitter(self):
+        if len(self.frame_times) < 3:
+            return 0
+        times = list(self.frame_times)
+        intervals = [b - a for a, b in zip(times, times[1:])]
+        return statistics.pstdev(intervals)
+
+    def stats(self):
+        return {
+            "tps": self.tps,
+            "fps": self.fps(),
+            "jitter": self.jitter(),
+            "lateness": statistics.mean(self.lateness) if len(self.lateness) > 0 else 0,
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "overrun policy": self.overrun_policy
+        }
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
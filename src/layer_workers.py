@@ -0,0 +1,172 @@
+import multiprocessing
+import pickle
+from multiprocessing import shared_memory
+import numpy as np
+from .config import config
+from .effects.effects import DYNAMIC
+from .effects.kernel_cache import KERNEL_CACHE
+from .effects.physics_effects import PhysicsEngine
+from .frame_buffer import FrameBuffer, COLOR_DTYPE
+from .frame_cache import FRAME_CACHE
+
+
+class LayerBuffers:
+    def __init__(self, n, slots, name=None):
+        self.n = n
+        self.slots = slots
+        self.owner = name is None
+        layer_bytes = n * 4 * np.dtype(COLOR_DTYPE).itemsize
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=slots * (layer_bytes + n))
+        self.layers = np.ndarray((slots, n, 4), dtype=COLOR_DTYPE, buffer=self.memory.buf)
+        self.covered = np.ndarray((slots, n), dtype=bool, buffer=self.memory.buf, offset=slots * layer_bytes)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def buffer(self, slot):
+        return FrameBuffer(array=self.layers[slot], covered=self.covered[slot])
+
+    def close(self):
+        self.layers = self.covered = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def run_layer_worker(connection, buffers_name, n, slots, processes):
+    FRAME_CACHE.max_bytes //= processes
+    buffers = LayerBuffers(n, slots, name=buffers_name)
+    effects = {}
+    while True:
+        message = connection.recv()
+        kind = message[0]
+        if kind == "add":
+            _, key, slot, data = message
+            effects[key] = (slot, pickle.loads(data))
+        elif kind == "drop":
+            effects.pop(message[1], None)
+        elif kind == "tick":
+            error = None
+            stats = {}
+            for key, (slot, effect) in effects.items():
+                try:
+                    effect.tick(buffers.buffer(slot), message[1])
+                except Exception as e:
+                    error = e
+                if isinstance(effect, PhysicsEngine):
+                    stats[key] = effect.stats()
+            caches = {"frame cache": FRAME_CACHE.stats(), "kernel cache": KERNEL_CACHE.stats()}
+            connection.send((error, stats, caches))
+        elif kind == "stop":
+            break
+    effects = None
+    buffers.close()
+
+
+class LayerWorkerPool:
+    def __init__(self, n, processes=None, slots=None):
+        if processes is None:
+            processes = config('layer workers.processes', default=max(1, multiprocessing.cpu_count() - 1))
+        if slots is None:
+            slots = config('layer workers.max layers', default=8)
+        self.buffers = LayerBuffers(n, slots)
+        self.free_slots = list(range(slots - 1, -1, -1))
+
+        context = multiprocessing.get_context(config('layer workers.start method', default="spawn"))
+        self.connections = []
+        self.processes = []
+        for i in range(processes):
+            connection, child = context.Pipe()
+            process = context.Process(
+                target=run_layer_worker,
+                args=(child, self.buffers.name, n, slots, processes),
+                name=f"layer worker {i}",
+                daemon=True
+            )
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+        self.assigned = {}
+        self.local = set()
+        self.load = [0 for i in range(processes)]
+        self.ticking = []
+        self.stats = {}
+        self.caches = [None for i in range(processes)]
+
+    def owns(self, effect):
+        return id(effect) in self.assigned
+
+    def physics_stats(self, effect):
+        return self.stats.get(id(effect))
+
+    def cache_stats(self, cache):
+        return [(f"layer worker {i}", caches[cache]) for i, caches in enumerate(self.caches) if caches is not None]
+
+    def start_tick(self, layers, effects, time_delta):
+        self._sync(layers, effects)
+        self.ticking = [i for i in range(len(self.connections)) if self.load[i] > 0]
+        for i in self.ticking:
+            self.connections[i].send(("tick", time_delta))
+
+    def finish_tick(self, layers, effects):
+        errors = []
+        for i in self.ticking:
+            error, stats, caches = self.connections[i].recv()
+            errors.append(error)
+            self.stats.update(stats)
+            self.caches[i] = caches
+        self.ticking = []
+        for layer, effect in zip(layers, effects):
+            if effect is not None and id(effect) in self.assigned:
+                slot = self.assigned[id(effect)][2]
+                layer.array[:] = self.buffers.layers[slot]
+                layer.covered[:] = self.buffers.covered[slot]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def _sync(self, layers, effects):
+        current = {id(effect): (layer, effect) for layer, effect in zip(layers, effects)
+                   if effect is not None and effect.type == DYNAMIC}
+        for key in list(self.assigned):
+            if key not in current:
+                self._drop(key)
+        self.local.intersection_update(current)
+
+        for key, (layer, effect) in current.items():
+            if key in self.assigned or key in self.local:
+                continue
+            if len(self.free_slots) == 0:
+                self.local.add(key)
+                continue
+            try:
+                data = pickle.dumps(effect)
+            except Exception:
+                self.local.add(key)
+                continue
+            worker = self.load.index(min(self.load))
+            slot = self.free_slots.pop()
+            self.buffers.layers[slot] = layer.array
+            self.buffers.covered[slot] = layer.covered
+            self.connections[worker].send(("add", key, slot, data))
+            self.assigned[key] = (effect, worker, slot)
+            self.load[worker] += 1
+
+    def _drop(self, key):
+        effect, worker, slot = self.assigned.pop(key)
+        self.stats.pop(key, None)
+        self.connections[worker].send(("drop", key))
+        self.free_slots.append(slot)
+        self.load[worker] -= 1
+
+    def stop(self):
+        for connection in self.connections:
+            connection.send(("stop",))
+        for process in self.processes:
+            process.join()
+        self.assigned = {}
+        self.stats = {}
+        self.caches = [None for i in self.caches]
+        self.buffers.close()
@@ -1,75 +1,115 @@
 import asyncio
-from asyncio.tasks import wait
-from .color_utils import multiply_colors
-from .effects.effects import STATIC, DYNAMIC, BaseEffect
-import datetime
+from .effects.effects import STATIC, DYNAMIC, BaseEffect, fold_static, cache_periodic
+from .effects.physics_effects import PhysicsEngine
+from .effects.kernel_cache import KERNEL_CACHE
+from .frame_cache import FRAME_CACHE
 from .color_utils import *
+from .config import config
+from .frame_scheduler import FrameScheduler, SKIP
+from .frame_output import FrameOutput
+from .layer_workers import LayerWorkerPool
 
 
-def merge_layers(layers, merge_behavior="OVERWRITE"):
-    result = [layers[0][i] for i in range(len(layers[0]))]
+BLEND_FUNCTIONS = {
+    "OVERWRITE": overlay_arrays,
+    "ADD": add_arrays,
+    "BLEND": blend_arrays,
+    "MULTIPLY": multiply_arrays
+}
+
 
-    for i in range(len(layers[0])):
-        if layers[0][i][:3] == (-1, -1, -1):
-            result[i] = (0, 0, 0, 0)
+def merge_layers(layers, merge_behavior="OVERWRITE"):
+    blend = BLEND_FUNCTIONS[merge_behavior]
+    colors = np.stack([layer.array for layer in layers])
+    covered = np.stack([layer.covered for layer in layers])[:, :, None]
 
+    result = np.where(covered[0], colors[0], 0)
     for i in range(1, len(layers)):
-        layer = layers[i]
-        for j in range(len(layer)):
-            if layer[j][:3] == (-1, -1, -1):
-                continue
-            elif merge_behavior == "OVERWRITE":
-                result[j] = overlay_colors(result[j], layer[j])
-            elif merge_behavior == "ADD":
-                result[j] = add_colors(result[j], layer[j])
-            elif merge_behavior == "BLEND":
-                result[j] = blend_colors(result[j], layer[j])
-            elif merge_behavior == "MULTIPLY":
-                result[j] = multiply_colors(result[j], layer[j])
-                
-    return result
+        result = np.where(covered[i], blend(result, colors[i]), result)
+
+    return FrameBuffer(array=result, covered=np.ones(len(result), dtype=bool))
 
 
 class NeoPixelController:
-    def __init__(self, pixels, tps=20):
-        self.delay = 1/tps
+    def __init__(self, pixels, tps=20, overrun_policy=None, threaded_output=None):
+        self.tps = tps
+        if overrun_policy is None:
+            overrun_policy = config('overrun policy', default=SKIP)
+        self.scheduler = FrameScheduler(tps, overrun_policy)
         self.paused = False
         self.pixels = pixels
 
+        if threaded_output is None:
+            threaded_output = config('output.threaded', default=True)
+        self.output = FrameOutput(pixels, 1 / tps, config('output.buffers', default=3), threaded_output)
+
         self.running = False
 
         self.N = len(pixels)
 
-        self.layers = [clone_pixels(pixels)]
+        self.layers = [FrameBuffer(self.N, fill=(0, 0, 0))]
         self.layer_index = 0
 
         self.effects = [None]
         self.merge_behavior = "OVERWRITE"
 
+        self.last_frame = None
+        self.dirty = True
+        self.idle = False
+        self.idle_enabled = config('idle when static', default=True)
+        self.woken = asyncio.Event()
+        self.unchanged = 0
+        self.frame_bus = None
+
+        self.workers = None
+        if config('layer workers.enabled', default=False):
+            self.workers = LayerWorkerPool(self.N)
+
     def set_effect(self, effect: BaseEffect):
         if not isinstance(effect, BaseEffect):
             raise Exception(f"{effect} is not a valid effect")
+        if effect.type == DYNAMIC:
+            effect = fold_static(effect)
+            effect = cache_periodic(effect, self.tps)
         self.effects[self.layer_index] = effect
+        self.invalidate()
+
+    def set_brightness(self, brightness):
+        self.output.set_brightness(brightness)
+
+    def invalidate(self):
+        self.dirty = True
+        self.idle = False
+        self.woken.set()
 
     def resume(self):
         self.paused = False
+        self.scheduler.resume()
 
     def pause(self):
         self.paused = True
+        self.scheduler.pause()
 
     def stop(self):
         print("stopped")
+        self.scheduler.stop()
+        self.woken.set()
+        self.output.stop()
+        if self.workers is not None:
+            self.workers.stop()
+            self.workers = None
         self.pixels.deinit()
-        self.layers = [[(-1, -1, -1) for i in range(self.N)]]
+        self.layers = [FrameBuffer(self.N, fill=UNSET)]
         self.effects = [None]
         self.running = False
         self.paused = False
 
     def add_layer(self):
         self.layers.insert(self.layer_index + 1,
-                           [(-1, -1, -1) for i in range(self.N)])
+                           FrameBuffer(self.N, fill=UNSET))
         self.effects.insert(self.layer_index + 1, None)
         self.layer_index = self.layer_index + 1
+        self.invalidate()
 
     def num_layers(self):
         return len(self.layers)
@@ -86,15 +126,18 @@ class NeoPixelController:
             self.add_layer()
         if self.layer_index < 0:
             self.layer_index = 0
+        self.invalidate()
 
     def clear_layer(self):
-        self.layers[self.layer_index] = [(-1, -1, -1) for i in range(self.N)]
+        self.layers[self.layer_index] = FrameBuffer(self.N, fill=UNSET)
         self.effects[self.layer_index] = None
+        self.invalidate()
 
     def reset_layers(self):
-        self.layers = [[(-1, -1, -1) for i in range(self.N)]]
+        self.layers = [FrameBuffer(self.N, fill=UNSET)]
         self.effects = [None]
         self.layer_index = 0
+        self.invalidate()
 
     def set_layer(self, layer_index):
         self.layer_index = layer_index
@@ -104,45 +147,88 @@ class NeoPixelController:
             self.layer_index = 0
 
     def change_merge_behavior(self, behavior):
-        acceptable = ["OVERWRITE", "ADD", "BLEND", "MULTIPLY"]
-        if behavior not in acceptable:
+        if behavior not in BLEND_FUNCTIONS:
             return False
         else:
             self.merge_behavior = behavior
+            self.invalidate()
             return True
 
-    async def run(self):
-        timer = datetime.datetime.now()
-        self.running = True
-        while self.running:
-            if (self.paused):
-                timer = datetime.datetime.now()
+    def frame_stats(self):
+        stats = self.scheduler.stats()
+        stats.update(self.output.stats())
+        stats["unchanged"] = self.unchanged
+        stats["idle"] = self.idle
+        return stats
+
+    def physics_stats(self):
+        stats = []
+        for i, effect in enumerate(self.effects):
+            if not isinstance(effect, PhysicsEngine):
                 continue
-            if ((datetime.datetime.now() - timer).total_seconds() < self.delay):
-                await asyncio.sleep(0.001)
+            if self.workers is not None and self.workers.owns(effect):
+                stats.append((i, self.workers.physics_stats(effect) or effect.stats()))
+            else:
+                stats.append((i, effect.stats()))
+        return stats
+
+    def frame_cache_stats(self):
+        stats = [("controller", FRAME_CACHE.stats())]
+        if self.workers is not None:
+            stats.extend(self.workers.cache_stats("frame cache"))
+        return stats
+
+    def kernel_cache_stats(self):
+        stats = [("controller", KERNEL_CACHE.stats())]
+        if self.workers is not None:
+            stats.extend(self.workers.cache_stats("kernel cache"))
+        return stats
+
+    def render(self, time_delta):
+        if self.workers is not None:
+            self.workers.start_tick(self.layers, self.effects, time_delta)
+
+        for i in range(self.num_layers()):
+            layer = self.layers[i]
+            effect = self.effects[i]
+
+            if (effect is None):
                 continue
 
-            prev_timer = timer
-            timer = datetime.datetime.now()
-            for i in range(self.num_layers()):
-                layer = self.layers[i]
-                effect = self.effects[i]
+            elif (effect.type == STATIC):
+                effect.tick(layer, 0)
+                self.effects[i] = None
 
-                if (effect is None):
-                    continue
+            elif (effect.type == DYNAMIC):
+                if self.workers is None or not self.workers.owns(effect):
+                    effect.tick(layer, time_delta)
 
-                elif (effect.type == STATIC):
-                    effect.tick(layer, 0)
-                    self.effects[i] = None
+        if self.workers is not None:
+            self.workers.finish_tick(self.layers, self.effects)
 
-                elif (effect.type == DYNAMIC):
-                    time_delta = datetime.datetime.now() - prev_timer
-                    effect.tick(layer, time_delta.total_seconds())
+        colors = merge_layers(self.layers, self.merge_behavior)
+        frame = colors.array[:, :3].astype(np.int64)
+        if not self.dirty and np.array_equal(frame, self.last_frame):
+            self.unchanged += 1
+        else:
+            self.output.submit(frame)
+            self.last_frame = frame
+            self.dirty = False
+        if self.frame_bus is not None:
+            self.frame_bus.publish(frame, self.layers)
 
-            colors = merge_layers(self.layers, self.merge_behavior)
-            for i in range(self.N):
-                self.pixels[i] = colors[i][:3]
-            # self.pixels[0] = (255, 255, 255)
-            self.pixels.show()
+        if self.idle_enabled and all(effect is None for effect in self.effects):
+            self.idle = True
 
-            await asyncio.sleep(0.001)
+    async def run(self):
+        self.running = True
+        while self.running:
+            if self.idle:
+                self.woken.clear()
+                await self.woken.wait()
+                self.scheduler.reset()
+                continue
+            time_delta = await self.scheduler.next_frame()
+            if not self.running:
+                break
+            self.render(time_delta)
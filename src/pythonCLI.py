@@ -160,6 +160,9 @@ class StackCLI:
         except Exception:
             raise Exception(f"Error: {args[1]} is not a valid TIME")
 
+        await self.sleep(time)
+
+    async def sleep(self, time):
         await asyncio.sleep(time)
 
     def process_read(self, args, nargs):
@@ -0,0 +1,225 @@
+import asyncio
+import io
+import multiprocessing
+import pickle
+from multiprocessing import shared_memory
+import numpy as np
+from .config import config
+from .drivers import create_pixels
+from .frame_buffer import COLOR_DTYPE
+from .neopixel_controller import NeoPixelController
+
+
+class EffectPickler(pickle.Pickler):
+    """Pickles an effect with a child of each random generator it holds.
+
+    The render process gets a copy of whatever it is sent, so pickling the
+    session generator as-is would hand every set_effect the same stream. Each
+    generator is instead replaced by one seeded from a draw on the original,
+    which keeps separately sent effects apart and still follows `seed`.
+    """
+
+    def reducer_override(self, obj):
+        if isinstance(obj, np.random.Generator):
+            return np.random.default_rng, (int(obj.integers(2 ** 63)),)
+        return NotImplemented
+
+
+def dumps_effect(effect):
+    buffer = io.BytesIO()
+    EffectPickler(buffer).dump(effect)
+    return buffer.getvalue()
+
+
+class FrameBus:
+    HEADER = 16
+
+    def __init__(self, n, max_layers, name=None):
+        self.n = n
+        self.max_layers = max_layers
+        layer_bytes = n * 4 * np.dtype(COLOR_DTYPE).itemsize
+        size = self.HEADER + max_layers * (layer_bytes + n) + n * 3
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+
+        buf = self.memory.buf
+        self.header = np.ndarray((2,), dtype=np.uint64, buffer=buf)
+        offset = self.HEADER
+        self.layers = np.ndarray((max_layers, n, 4), dtype=COLOR_DTYPE, buffer=buf, offset=offset)
+        offset += max_layers * layer_bytes
+        self.covered = np.ndarray((max_layers, n), dtype=bool, buffer=buf, offset=offset)
+        offset += max_layers * n
+        self.frame = np.ndarray((n, 3), dtype=np.uint8, buffer=buf, offset=offset)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def publish(self, frame, layers):
+        count = min(len(layers), self.max_layers)
+        self.header[0] += 1
+        self.frame[:] = np.clip(frame[:, :3], 0, 255)
+        for i in range(count):
+            self.layers[i] = layers[i].array
+            self.covered[i] = layers[i].covered
+        self.header[1] = count
+        self.header[0] += 1
+
+    def read(self):
+        while True:
+            sequence = int(self.header[0])
+            if sequence % 2 == 1:
+                continue
+            frame = self.frame.copy()
+            count = int(self.header[1])
+            layers = self.layers[:count].copy()
+            covered = self.covered[:count].copy()
+            if int(self.header[0]) == sequence:
+                return frame, layers, covered
+
+    def close(self):
+        self.header = self.frame = self.layers = self.covered = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+async def serve(commands, replies, bus_name, n, brightness, tps, driver):
+    pixels = create_pixels(n, brightness, driver)
+    controller = NeoPixelController(pixels, tps=tps)
+    controller.frame_bus = FrameBus(n, config('render process.max layers', default=8), name=bus_name)
+    task = asyncio.create_task(controller.run())
+
+    loop = asyncio.get_running_loop()
+    while True:
+        method, args, reply = await loop.run_in_executor(None, commands.get)
+        result = None
+        error = None
+        try:
+            if method == "set_effect":
+                args = (pickle.loads(args[0]),)
+            result = getattr(controller, method)(*args)
+        except Exception as e:
+            error = e
+        if reply:
+            replies.put((result, error))
+        if method == "stop":
+            break
+
+    await task
+    controller.frame_bus.close()
+
+
+def run_render_process(commands, replies, bus_name, n, brightness, tps, driver):
+    asyncio.run(serve(commands, replies, bus_name, n, brightness, tps, driver))
+
+
+class RenderProcessController:
+    def __init__(self, n, brightness=1.0, tps=20, driver=None):
+        self.N = n
+        self.tps = tps
+        self.running = False
+        self.paused = False
+
+        context = multiprocessing.get_context(config('render process.start method', default="spawn"))
+        self.bus = FrameBus(n, config('render process.max layers', default=8))
+        self.commands = context.Queue()
+        self.replies = context.Queue()
+        self.process = context.Process(
+            target=run_render_process,
+            args=(self.commands, self.replies, self.bus.name, n, brightness, tps, driver),
+            name="render",
+            daemon=not config('layer workers.enabled', default=False)
+        )
+        self.process.start()
+
+    def _send(self, method, *args):
+        self.commands.put((method, args, False))
+
+    def _call(self, method, *args):
+        self.commands.put((method, args, True))
+        result, error = self.replies.get(timeout=config('render process.timeout', default=5))
+        if error is not None:
+            raise error
+        return result
+
+    def set_effect(self, effect):
+        try:
+            data = dumps_effect(effect)
+        except Exception as e:
+            raise Exception(f"{effect} cannot be sent to the render process: {e}")
+        self._call("set_effect", data)
+
+    def set_brightness(self, brightness):
+        self._send("set_brightness", brightness)
+
+    def invalidate(self):
+        self._send("invalidate")
+
+    def resume(self):
+        self.paused = False
+        self._send("resume")
+
+    def pause(self):
+        self.paused = True
+        self._send("pause")
+
+    def stop(self):
+        if not self.process.is_alive():
+            return
+        self._call("stop")
+        self.process.join()
+        self.bus.close()
+        self.running = False
+        self.paused = False
+
+    def add_layer(self):
+        self._send("add_layer")
+
+    def num_layers(self):
+        return self._call("num_layers")
+
+    def current_layer(self):
+        return self._call("current_layer")
+
+    def delete_layer(self):
+        self._send("delete_layer")
+
+    def clear_layer(self):
+        self._send("clear_layer")
+
+    def reset_layers(self):
+        self._send("reset_layers")
+
+    def set_layer(self, layer_index):
+        self._send("set_layer", layer_index)
+
+    def change_merge_behavior(self, behavior):
+        return self._call("change_merge_behavior", behavior)
+
+    def frame_stats(self):
+        return self._call("frame_stats")
+
+    def physics_stats(self):
+        return self._call("physics_stats")
+
+    def frame_cache_stats(self):
+        return self._call("frame_cache_stats")
+
+    def kernel_cache_stats(self):
+        return self._call("kernel_cache_stats")
+
+    def last_frame(self):
+        return self.bus.read()[0]
+
+    async def run(self):
+        self.running = True
+        await asyncio.get_running_loop().run_in_executor(None, self.process.join)
+        self.running = False
+
+
+def create_controller(n, brightness=1.0, tps=20):
+    if config('render process.enabled', default=False):
+        return RenderProcessController(n, brightness, tps), None
+    pixels = create_pixels(n, brightness)
+    return NeoPixelController(pixels, tps=tps), pixels
@@ -7,8 +7,7 @@ from .colors import *
 import asyncio
 from .effects.music_effects import *
 from .neopixel_controller import *
-import board
-import neopixel
+from .render_process import create_controller
 import wave as wav
 import pafy
 import ffmpeg
@@ -63,6 +62,7 @@ class State(ControlState):
         self.vars = {}
         self.last_command_result = None
         self.playback = None
+        self.rng = np.random.default_rng()
 
 
 rgb = CommandBuilder("rgb", lambda r, g, b, a: ColorAdapter(SingleColorSelector((r, g, b, a))), [
@@ -378,7 +378,7 @@ def physics(state, nargs, args):
         if not isinstance(particle, PhysicsEffect):
             raise Exception(f"Error: {args[1]} is not a list of particles, {particle} is not a valid effect")
     
-    state.last_command_result = PhysicsEngine(particles)
+    state.last_command_result = PhysicsEngine(particles, rng=state.rng)
     
 
 def particle(state, nargs, args):
@@ -632,7 +632,7 @@ def randchoice(state, nargs, args):
         if reroll is None:
             raise Exception(f"Error: {args[2]} is not a valid integer")
     
-    state.last_command_result = RandChoice(effects, reroll)
+    state.last_command_result = RandChoice(effects, reroll, state.rng)
 
 
 def randtime(state, nargs, args):
@@ -656,7 +656,7 @@ def randtime(state, nargs, args):
         if reroll is None:
             raise Exception(f"Error: {args[4]} is not a valid integer")
 
-    state.last_command_result = RandTime(effect, lower, upper, reroll)
+    state.last_command_result = RandTime(effect, lower, upper, reroll, state.rng)
 
 def randwarp(state, nargs, args):
     if nargs not in [4, 5]:
@@ -679,7 +679,7 @@ def randwarp(state, nargs, args):
         if reroll is None:
             raise Exception(f"Error: {args[4]} is not a valid integer")
 
-    state.last_command_result = RandWarp(effect, lower, upper, reroll)
+    state.last_command_result = RandWarp(effect, lower, upper, reroll, state.rng)
     
 
 def randselect(state, nargs, args):
@@ -696,7 +696,7 @@ def randselect(state, nargs, args):
         if reroll is None:
             raise Exception(f"Error: {args[2]} is not a valid integer")
     
-    state.last_command_result = RandSelector(effect, reroll)
+    state.last_command_result = RandSelector(effect, reroll, state.rng)
 
 
 def randpbody(state, nargs ,args):
@@ -750,7 +750,8 @@ def randpbody(state, nargs ,args):
         if reroll is None:
             raise Exception(f"Error: {args[79]} is not a valid integer")
 
-    state.last_command_result = RandPBody(min_pos, max_pos, min_vel, max_vel, min_acc, max_acc, min_mass, max_mass, reroll)
+    state.last_command_result = RandPBody(min_pos, max_pos, min_vel, max_vel, min_acc, max_acc, min_mass, max_mass, reroll,
+                                         state.rng)
     
     
 def share(state, nargs, args):
@@ -819,8 +820,10 @@ def brightness(state, nargs, args):
     else:
         raise Exception(f"Format: {args[0]} value")
 
-    state.pixels.brightness = brightness
-    state.pixels.show()
+    if state.controller is not None:
+        state.controller.set_brightness(brightness)
+    else:
+        state.pixels.brightness = brightness
 
 
 def pause(state, nargs, args):
@@ -836,17 +839,69 @@ def stop(state, nargs, args):
     state.controller = None
 
 
+def seed(state, nargs, args):
+    if nargs not in [1, 2]:
+        raise Exception(f"Format: {args[0]} <SEED>")
+
+    value = None
+    if nargs > 1:
+        value = parse_int(args[1])
+        if value is None or value < 0:
+            raise Exception(f"Error: {args[1]} is not a valid non-negative integer")
+    state.rng.bit_generator.state = np.random.default_rng(value).bit_generator.state
+
+
 def restart(state, nargs, args):
     if state.controller is not None:
         state.controller.stop()
-    pixels = neopixel.NeoPixel(
-        board.D10, 150, brightness=0.35, auto_write=False)
-    pixel_control = NeoPixelController(pixels, tps=60)
+    pixel_control, pixels = create_controller(150, brightness=0.35, tps=60)
     state.controller = pixel_control
     state.pixels = pixels
     asyncio.create_task(pixel_control.run())
 
 
+def frame_stats(state, nargs, args):
+    stats = state.controller.frame_stats()
+    state.send(
+        f"{stats['fps']:.2f}/{stats['tps']} fps, "
+        f"jitter {stats['jitter'] * 1000:.2f} ms, "
+        f"lateness {stats['lateness'] * 1000:.2f} ms, "
+        f"skipped {stats['skipped']} of {stats['frames']} frames ({stats['overrun policy']}), "
+        f"{stats['unchanged']} unchanged frames not shown, "
+        f"{stats['dropped']} dropped and {stats['late']} late of {stats['shows']} shown"
+        f"{', idle' if stats['idle'] else ''}")
+
+
+def frame_cache_stats(state, nargs, args):
+    for process, stats in state.controller.frame_cache_stats():
+        state.send(
+            f"{process}: {stats['rings']} rings, "
+            f"{stats['bytes'] / 2**20:.2f}/{stats['max bytes'] / 2**20:.2f} MB, "
+            f"{stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions")
+
+
+def physics_stats(state, nargs, args):
+    engines = state.controller.physics_stats()
+    if len(engines) == 0:
+        state.send("No physics engines running")
+        return
+    for layer, stats in engines:
+        state.send(
+            f"Layer {layer}: {stats['particles']}/{stats['max particles']} particles, "
+            f"{stats['culled']} culled, {stats['evicted']} evicted ({stats['eviction']}), "
+            f"{stats['collisions']} collisions resolved, "
+            f"{stats['substeps']} substeps, {stats['dropped steps']} dropped steps")
+
+
+def kernel_cache_stats(state, nargs, args):
+    for process, stats in state.controller.kernel_cache_stats():
+        state.send(
+            f"{process}: {stats['kernels']}/{stats['max kernels']} kernels at {stats['buckets']} offsets, "
+            f"{stats['bytes'] / 2**10:.1f} KB, "
+            f"{stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions, "
+            f"{stats['overflows']} overflows")
+
+
 def get_vars(state, nargs, args):
     value = "==========================\nVariables\n==========================\n"
     max_len = 0
@@ -972,6 +1027,11 @@ commands = [
     Command("resume", resume),
     Command("exit", stop),
     Command("restart", restart),
+    Command("seed", seed, n_args=1),
+    Command("framestats", frame_stats),
+    Command("framecache", frame_cache_stats),
+    Command("kernelcache", kernel_cache_stats),
+    Command("physicsstats", physics_stats),
     Command("vars", get_vars),
 
     Command("addlayer", add_layer),